@@ -1,5 +1,10 @@
+from .cache import *
+from .checkpoint import *
 from .computation import *
+from .counting import *
+from .graph_sum import *
 from .organization import *
 from .simplification import *
 from .star import *
+from .store import *
 from .visualization import *
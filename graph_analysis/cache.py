@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional
+
+from graph_expansion import *
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: Optional[int]
+    # Number of leading terms the entries stand for, which is what maxsize bounds
+    currsize: int
+
+
+class CachedSubtree(NamedTuple):
+    # The leading terms below the graph that was expanded to make the entry, in its
+    # labels. The terms below a child that has an entry of its own are not copied: the
+    # child's entry is kept as (entry, labeling, offset), which maps its b indices to
+    # these labels (see unfold_subtree)
+    items: tuple["Graph | tuple[CachedSubtree, Labeling, int]", ...]
+    n_terms: int
+    # The canonical labeling and the largest b index of the graph that was expanded
+    labeling: Labeling
+    max_b_index: int
+
+
+class ExpansionCache:
+    # Maps (canonical key, traces left to expand, order, expansion flags) to the
+    # CachedSubtree of a graph with that key, evicting the least recently used entries
+    # once they stand for more than maxsize leading terms. The traces are
+    # relabeled and kept in their stored order and rotation, which decide the expansion
+    # but not the canonical key. Entries share the entries of their children, so this
+    # also bounds the number of graphs the cache keeps alive
+    _entries: OrderedDict[Hashable, CachedSubtree]
+    _maxsize: Optional[int]
+    _size: int
+    _hits: int
+    _misses: int
+    _evictions: int
+
+    def __init__(self, maxsize: Optional[int] = 1_000_000):
+        self._entries = OrderedDict()
+        self._maxsize = maxsize
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[CachedSubtree]:
+        if key not in self._entries:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: Hashable, subtree: CachedSubtree):
+        # Entries that don't fit on their own are not stored
+        if self._maxsize is not None and _weight(subtree) > self._maxsize:
+            return
+        if key in self._entries:
+            self._size -= _weight(self._entries[key])
+        self._entries[key] = subtree
+        self._entries.move_to_end(key)
+        self._size += _weight(subtree)
+        while self._maxsize is not None and self._size > self._maxsize:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= _weight(evicted)
+            self._evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            self._hits, self._misses, self._evictions, self._maxsize, self._size
+        )
+
+
+def _weight(subtree: CachedSubtree) -> int:
+    # Entries with no leading terms still take some memory
+    return max(subtree.n_terms, 1)
+
+
+def unfold_subtree(
+    subtree: CachedSubtree, labeling: Labeling, offset: int, out: list[Graph]
+):
+    # Appends the leading terms of subtree to out, with the b indices in labeling
+    # mapped by it and the other b indices shifted by offset. Each term is relabeled
+    # once, however deep its entry is
+    identity = offset == 0 and all([u == v for u, v in labeling.items()])
+    for item in subtree.items:
+        if isinstance(item, Graph):
+            if identity:
+                out.append(item)
+                continue
+            replacement_map = {
+                i: labeling[i] if i in labeling else b(i.i + offset)
+                for i in b_indices(item)
+            }
+            out.append(relabel(item, replacement_map))
+        else:
+            child, child_labeling, child_offset = item
+            # From the labels of child to the labels of subtree, then to the labels of out
+            unfold_subtree(
+                child,
+                {
+                    u: labeling[v] if v in labeling else b(v.i + offset)
+                    for u, v in child_labeling.items()
+                },
+                child_offset + offset,
+                out,
+            )
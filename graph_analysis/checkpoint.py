@@ -0,0 +1,30 @@
+import os
+import pickle
+from collections import Counter
+from typing import NamedTuple
+
+from graph_expansion import *
+
+
+class Checkpoint(NamedTuple):
+    x0: Graph
+    o: int
+    stack: list[Graph]
+    leading_terms: list[Graph]
+    stats: Counter[str]
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint):
+    # Write to a temporary file first so that a crash never leaves a truncated checkpoint
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    with open(path, "rb") as f:
+        checkpoint = pickle.load(f)
+    if not isinstance(checkpoint, Checkpoint):
+        raise TypeError(f"{path} does not contain a Checkpoint")
+    return checkpoint
@@ -0,0 +1,205 @@
+from collections import Counter
+from typing import NamedTuple, Sequence
+
+from graph_expansion import *
+
+from .computation import classify, iter_children, iter_leading_terms, order
+
+# Count-only expansion. Instead of collecting the leading terms, each one is reduced to
+# a LeafCode, and only the number of leading terms with each code is kept.
+#
+# The expansion rules only look at the light-weights and G-loops of a graph (its
+# residual), and only at whether an index is an a or a b, never at its value. The
+# codes only depend on the coefficients and deterministic traces, which the rules pass
+# on untouched. So the codes below a graph are the code of its coefficients and
+# deterministic traces combined with the codes that expanding its residual adds, and
+# these only depend on the Shape of the residual and on how much order is left. They
+# are computed once per (shape, budget) on a representative Graph made from the shape,
+# whose children change the order by as much as the children of the graphs it stands
+# for. Subtrees whose residuals only differ in their indices are counted once, and no
+# leading term is kept
+
+# (total n_thetas, number of long edges, loop pattern)
+LeafCode = tuple[int, int, tuple[tuple[int, ...], ...]]
+# The factor keys of the light-weights and of the G-loops of a representative (see
+# residual_representative), in their stored order and rotation
+Shape = tuple[tuple[tuple, ...], tuple[tuple, ...]]
+
+
+class LeafCounts(NamedTuple):
+    leading_terms: int
+    # Keyed by canonical_pattern(m_loop_pattern(x, signed))
+    patterns: Counter[tuple[tuple[int, ...], ...]]
+    # Keyed by the number of Theta and STheta coefficients with opposite charges
+    long_edges: Counter[int]
+    # Sum of the n_thetas of every leading term
+    n_thetas: int
+
+
+def count_leading_terms(
+    x0: Graph,
+    o: int,
+    signed=True,
+    verbose=False,
+    prune=True,
+) -> LeafCounts:
+    # Same leading terms as compute_leading_terms, but only their statistics are
+    # returned. Every rule keeps the b indices of a graph on its coefficients if they
+    # are to begin with, which the shapes rely on, so other graphs are counted by
+    # expanding them as usual
+    stats: Counter[str] = Counter()
+    memo: dict[tuple[Shape, int], Counter[LeafCode]] = {}
+
+    def _count(x: Graph, budget: int) -> Counter[LeafCode]:
+        # Codes added below x, a representative with order(x) + budget = o for the
+        # graph it stands for
+        x_o = order(x) + budget
+        leaves: Counter[LeafCode] = Counter()
+        stats["expansions"] += 1
+        for y in iter_children(x, x_o):
+            kind = classify(y, x_o, prune)
+            stats[kind] += 1
+            if kind == "leading_terms":
+                leaves[graph_leaf_code(y, signed)] += 1
+            elif kind == "expansions":
+                code = graph_leaf_code(y, signed)
+                for leaf, multiplicity in _codes_below(y, x_o - order(y)).items():
+                    leaves[combine_leaf_codes(code, leaf)] += multiplicity
+        return leaves
+
+    def _codes_below(x: Graph, budget: int) -> Counter[LeafCode]:
+        key = (residual_shape(x), budget)
+        if key not in memo:
+            memo[key] = _count(residual_representative(x), budget)
+        else:
+            stats["hits"] += 1
+        return memo[key]
+
+    kind = classify(x0, o, prune)
+    if kind == "leading_terms":
+        leaves = Counter([graph_leaf_code(x0, signed)])
+    elif kind != "expansions":
+        leaves = Counter()
+    elif not can_predict_order(x0):
+        leaves = Counter(
+            [
+                graph_leaf_code(x, signed)
+                for x in iter_leading_terms(x0, o, stats=stats, prune=prune)
+            ]
+        )
+    else:
+        code = graph_leaf_code(x0, signed)
+        leaves = Counter()
+        for leaf, multiplicity in _codes_below(x0, o - order(x0)).items():
+            leaves[combine_leaf_codes(code, leaf)] += multiplicity
+    counts = leaf_counts(leaves)
+
+    if verbose:
+        render(x0)
+        print(f"# order {o} deterministics: ", counts.leading_terms)
+        print("# patterns:               ", len(counts.patterns))
+        print("# n_thetas:               ", counts.n_thetas)
+        print("# pruned graphs:          ", stats["pruned"])
+        print("# expansions:             ", stats["expansions"])
+        print("# shapes reused:          ", stats["hits"])
+
+    return counts
+
+
+def residual_representative(x: Graph) -> Graph:
+    # The light-weights and G-loops of x with every a index replaced by a(1) and every
+    # b index by b(1), and I(b(1), b(1)) to keep b(1) on a coefficient. Its children
+    # have the same codes and order changes as the children of x
+    light_weights, g_loops = [
+        tuple([relabel_trace(t, _collapsed(t)) for t in traces])
+        for traces in [x.light_weights, x.g_loops]
+    ]
+    traces = light_weights + g_loops
+    coefficients = [I(b(1), b(1))] if any([t.b_indices for t in traces]) else []
+    return Graph.from_parts(coefficients, traces, (), light_weights, g_loops)
+
+
+def residual_shape(x: Graph) -> Shape:
+    # The shape of residual_representative(x), without building it
+    return (
+        tuple([_collapsed_key(t) for t in x.light_weights]),
+        tuple([_collapsed_key(t) for t in x.g_loops]),
+    )
+
+
+def combine_leaf_codes(code1: LeafCode, code2: LeafCode) -> LeafCode:
+    # The code of a graph whose coefficients and deterministic traces are those of two
+    # graphs with these codes. The loops of both patterns are already rotated
+    loops = sorted(code1[2] + code2[2], key=_loop_sort_key)
+    return code1[0] + code2[0], code1[1] + code2[1], tuple(loops)
+
+
+def leaf_counts(leaves: Counter[LeafCode]) -> LeafCounts:
+    patterns: Counter[tuple[tuple[int, ...], ...]] = Counter()
+    long_edges: Counter[int] = Counter()
+    n_thetas = 0
+    for (leaf_n_thetas, n_long_edges, pattern), multiplicity in leaves.items():
+        patterns[pattern] += multiplicity
+        long_edges[n_long_edges] += multiplicity
+        n_thetas += leaf_n_thetas * multiplicity
+    return LeafCounts(leaves.total(), patterns, long_edges, n_thetas)
+
+
+def graph_leaf_code(x: Graph, signed=True) -> LeafCode:
+    loops = [m_charges(t, signed) for t in x.deterministics if len(t) != 4]
+    return leaf_code(x.coefficients, loops, signed)
+
+
+def leaf_code(
+    coefficients: Sequence[Coefficient], loops: list[tuple[int, ...]], signed=True
+) -> LeafCode:
+    n_thetas = 0
+    n_long_edges = 0
+    loops = list(loops)
+    for c in coefficients:
+        n_thetas += c.n_thetas
+        if isinstance(c, Theta | STheta) and c.charges[0] != c.charges[1]:
+            n_long_edges += 1
+        # Same as m_loop_pattern
+        if isinstance(c, ThetacalM):
+            loops.append(
+                tuple(
+                    int(charge == Charge.Minus) if signed else 0 for charge in c.charges
+                )
+            )
+    return n_thetas, n_long_edges, canonical_pattern(loops)
+
+
+def canonical_pattern(
+    pattern: Sequence[tuple[int, ...]],
+) -> tuple[tuple[int, ...], ...]:
+    # Equal for two patterns if and only if patterns_are_same
+    loops = [l[i:] + l[:i] for l in pattern for i in [least_rotation(l)]]
+    loops.sort(key=_loop_sort_key)
+    return tuple(loops)
+
+
+def _loop_sort_key(loop: tuple[int, ...]) -> tuple:
+    return len(loop), sum(loop), loop
+
+
+def m_charges(factors: Sequence[MatrixFactor], signed=True) -> tuple[int, ...]:
+    # E.g., <MEM^*EME> -> (0, 1, 0)
+    return tuple(
+        int(f.charge == Charge.Minus) if signed else 0
+        for f in factors
+        if isinstance(f, M)
+    )
+
+
+def _collapsed(t: Trace) -> Labeling:
+    return {f.i: a(1) if isinstance(f.i, a) else b(1) for f in t if isinstance(f, E)}
+
+
+_COLLAPSED_E_KEYS = {a: E(a(1)).key, b: E(b(1)).key}
+
+
+def _collapsed_key(t: Trace) -> tuple:
+    return tuple(
+        [_COLLAPSED_E_KEYS[type(f.i)] if isinstance(f, E) else f.key for f in t]
+    )
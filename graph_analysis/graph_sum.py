@@ -0,0 +1,141 @@
+from fractions import Fraction
+from typing import Iterable, Iterator, Optional
+
+from graph_expansion import *
+
+# Linear combinations of graphs with integer or rational coefficients. Like terms, the
+# graphs that agree up to relabeling b indices, share one entry under their canonical
+# key, which holds the first of them to be added, so memory grows with the number of
+# distinct terms rather than the number of terms added. Entries whose coefficients add
+# up to 0 are dropped
+
+Scalar = int | Fraction
+
+
+class GraphSum(Texable):
+    __slots__ = ("_terms",)
+    _terms: dict[CanonicalKey, tuple[Graph, Scalar]]
+
+    def __init__(self, terms: Iterable[Graph | tuple[Graph, Scalar]] = ()):
+        self._terms = {}
+        for term in terms:
+            if isinstance(term, Graph):
+                self.add(term)
+            else:
+                self.add(*term)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __iter__(self) -> Iterator[Graph]:
+        for x, _ in self._terms.values():
+            yield x
+
+    def __contains__(self, x: Graph):
+        return canonical_key(x) in self._terms
+
+    def __getitem__(self, x: Graph) -> Scalar:
+        # The coefficient of the like term of x, 0 if there is none
+        entry = self._terms.get(canonical_key(x))
+        return 0 if entry is None else entry[1]
+
+    def __eq__(self, other):
+        if not isinstance(other, GraphSum):
+            return False
+        return {key: c for key, (_, c) in self._terms.items()} == {
+            key: c for key, (_, c) in other._terms.items()
+        }
+
+    def __add__(self, other: "GraphSum") -> "GraphSum":
+        if not isinstance(other, GraphSum):
+            return NotImplemented
+        out = self.copy()
+        out.update(other)
+        return out
+
+    def __radd__(self, other) -> "GraphSum":
+        # So that sum() works, starting from 0
+        if isinstance(other, int) and other == 0:
+            return self.copy()
+        return NotImplemented
+
+    def __iadd__(self, other: "GraphSum") -> "GraphSum":
+        if not isinstance(other, GraphSum):
+            return NotImplemented
+        self.update(other)
+        return self
+
+    def __neg__(self) -> "GraphSum":
+        return self * -1
+
+    def __sub__(self, other: "GraphSum") -> "GraphSum":
+        if not isinstance(other, GraphSum):
+            return NotImplemented
+        return self + -other
+
+    def __mul__(self, scalar: Scalar) -> "GraphSum":
+        if not isinstance(scalar, int | Fraction):
+            return NotImplemented
+        out = GraphSum()
+        if scalar:
+            out._terms = {key: (x, c * scalar) for key, (x, c) in self._terms.items()}
+        return out
+
+    __rmul__ = __mul__
+
+    def __tex__(self):
+        if not self._terms:
+            return "0"
+        out = ""
+        for k, (x, c) in enumerate(self._terms.values()):
+            if c < 0:
+                out += " - " if k else "-"
+            elif k:
+                out += " + "
+            if abs(c) != 1:
+                c = abs(c)
+                out += (
+                    str(c)
+                    if c.denominator == 1
+                    else Rf"\frac{{{c.numerator}}}{{{c.denominator}}}"
+                )
+            out += tex(x)
+        return out
+
+    def add(self, x: Graph, coefficient: Scalar = 1):
+        self._add(canonical_key(x), x, coefficient)
+
+    def update(self, other: "GraphSum"):
+        # Adds other in place, reusing its canonical keys
+        for key, (x, c) in other._terms.items():
+            self._add(key, x, c)
+
+    def copy(self) -> "GraphSum":
+        out = GraphSum()
+        out._terms = dict(self._terms)
+        return out
+
+    def items(self) -> Iterator[tuple[Graph, Scalar]]:
+        yield from self._terms.values()
+
+    @staticmethod
+    def merge(sums: Iterable["GraphSum"]) -> "GraphSum":
+        # E.g. the partial sums computed by workers
+        out = GraphSum()
+        for s in sums:
+            out.update(s)
+        return out
+
+    def _add(self, key: CanonicalKey, x: Graph, coefficient: Scalar):
+        entry: Optional[tuple[Graph, Scalar]] = self._terms.get(key)
+        if entry is None:
+            if coefficient:
+                self._terms[key] = (x, coefficient)
+            return
+
+        representative, previous_coefficient = entry
+        total = previous_coefficient + coefficient
+        if total:
+            self._terms[key] = (representative, total)
+        else:
+            del self._terms[key]
@@ -1,5 +1,14 @@
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import cache
+from itertools import islice
+from typing import Iterable, Iterator, NamedTuple, Sequence
+
 from graph_expansion import *
 
+from .graph_sum import GraphSum
+from .store import TermStore
+
 
 def matrix_multiplication(pre: list[Graph]) -> list[Graph]:
     # Perform some simple matrix multiplication
@@ -9,56 +18,7 @@ def matrix_multiplication(pre: list[Graph]) -> list[Graph]:
         old_coefficients = x.coefficients
         old_traces = x.traces
 
-        coefficients: list[Coefficient] = list(old_coefficients)
-        removed_indices: set[Symbol] = set()
-
-        finished = False
-        while True:
-            if finished:
-                break
-            finished = True
-
-            next_coefficients: list[Coefficient] = []
-            coefficients_to_remove: list[int] = []
-            for i, c in enumerate(coefficients):
-                if i in coefficients_to_remove:
-                    continue
-                for j, c1 in enumerate(coefficients[i + 1 :]):
-                    j = i + 1 + j
-                    if j in coefficients_to_remove:
-                        continue
-                    if not set(c.indices) & set(c1.indices):
-                        continue
-                    assert len(set(c.indices) & set(c1.indices)) == 1
-
-                    finished = False
-                    product = single_matrix_multiplication(c, c1)
-                    # except:
-                    #     render(x)
-                    #     render(c)
-                    #     render(c1)
-
-                    if not product:
-                        continue
-
-                    next_coefficients.append(product)
-                    coefficients_to_remove.extend([i, j])
-                    removed_indices.union(set(c.indices) & set(c1.indices))
-
-                    break
-
-            next_coefficients += [
-                c for i, c in enumerate(coefficients) if i not in coefficients_to_remove
-            ]
-            coefficients = next_coefficients
-
-        assert all([isinstance(i, b) for i in removed_indices])
-
-        # Double-check that each b_i only appears at most twice
-        for t in x.traces:
-            for f in enumerate(t):
-                if isinstance(f, E):
-                    assert f.i not in removed_indices
+        coefficients = contract_coefficients(list(old_coefficients))
 
         # Replace internal a_i's with delta_{a_ib_i}'s
         traces: list[Trace] = []
@@ -83,142 +43,308 @@ def matrix_multiplication(pre: list[Graph]) -> list[Graph]:
     return out
 
 
+def matrix_multiplication_sum(pre: GraphSum | Iterable[Graph]) -> GraphSum:
+    # matrix_multiplication of each term, collected into like terms
+    terms = pre.items() if isinstance(pre, GraphSum) else ((x, 1) for x in pre)
+    out = GraphSum()
+    for x, coefficient in terms:
+        (y,) = matrix_multiplication([x])
+        out.add(y, coefficient)
+    return out
+
+
+def simplify_batch(
+    terms: Iterable[Graph],
+    workers: Optional[int] = None,
+    chunksize: int = 256,
+    cancel=True,
+) -> Iterator[Graph]:
+    # Runs matrix_multiplication on each graph of terms, then vertical_cancel if cancel,
+    # in a process pool. Chunks of chunksize graphs go to the workers and back as
+    # TermStores rather than as pickled graphs. At most two chunks per worker are in
+    # flight, and the graphs are yielded in the order of terms as their chunks finish
+    terms = iter(terms)
+    if not workers:
+        for x in terms:
+            yield _simplify(x, cancel)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque[Future[TermStore]] = deque()
+        while chunk := list(islice(terms, chunksize)):
+            if len(pending) == 2 * workers:
+                yield from pending.popleft().result()
+            pending.append(pool.submit(_simplify_chunk, TermStore(chunk), cancel))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _simplify_chunk(store: TermStore, cancel: bool) -> TermStore:
+    return TermStore(_simplify(x, cancel) for x in store)
+
+
+def _simplify(x: Graph, cancel: bool) -> Graph:
+    (y,) = matrix_multiplication([x])
+    return vertical_cancel(y) if cancel else y
+
+
+def contract_coefficients(coefficients: list[Coefficient]) -> list[Coefficient]:
+    # Multiplies coefficients that share an index until no two of them do. Each pass
+    # pairs every coefficient, in order, with the first later coefficient that shares an
+    # index with it and can be multiplied with it, and the products come first in the
+    # next pass. The coefficients sharing an index are found with a map from each index
+    # to the positions of the coefficients it appears on, so a pass is linear
+    while True:
+        positions: dict[Symbol, list[int]] = defaultdict(list)
+        for k, c in enumerate(coefficients):
+            for i in set(c.indices):
+                positions[i].append(k)
+
+        products: list[Coefficient] = []
+        removed = [False] * len(coefficients)
+        for k, c in enumerate(coefficients):
+            if removed[k]:
+                continue
+            neighbors = sorted(
+                {l for i in set(c.indices) for l in positions[i] if l > k}
+            )
+            for l in neighbors:
+                if removed[l]:
+                    continue
+                c1 = coefficients[l]
+                assert len(set(c.indices) & set(c1.indices)) == 1
+
+                product = single_matrix_multiplication(c, c1)
+                if not product:
+                    continue
+
+                products.append(product)
+                removed[k] = removed[l] = True
+                break
+
+        # Without products, the next pass would be the same
+        if not products:
+            return coefficients
+        coefficients = products + [
+            c for k, c in enumerate(coefficients) if not removed[k]
+        ]
+
+
+# Vertical cancellation: two terms that only differ in that one has \Theta\M S_{ij}
+# where the other has I_{ij} add up to the term with \Theta_{ij} instead, and similarly
+# for S\Theta\M S and S. Maps the class of the product to the classes of the identity
+# it cancels with and of the result
+VERTICAL_CANCELLATIONS: dict[
+    type[Coefficient], tuple[type[Coefficient], type[Coefficient]]
+] = {
+    ThetacalMS: (I, Theta),
+    SThetacalMS: (S, STheta),
+}
+# Whether a class is the product or the identity, and the product it cancels with
+_vertical_roles: dict[type[Coefficient], tuple[bool, type[Coefficient]]] = {
+    cls: role
+    for product, (identity, _) in VERTICAL_CANCELLATIONS.items()
+    for cls, role in [(product, (True, product)), (identity, (False, product))]
+}
+
+
+class VerticalCancellation(NamedTuple):
+    product_term: Graph
+    identity_term: Graph
+    merged: Graph
+
+
 def vertical_cancel(x: Graph) -> Graph:
     coefficients: list[Coefficient] = []
     for c in x.coefficients:
-        if isinstance(c, ThetacalMS):
-            coefficients.append(Theta(c.charges[0], c.charges[1], c.i, c.j))
-        elif isinstance(c, SThetacalMS):
-            coefficients.append(STheta(c.charges[0], c.charges[1], c.i, c.j))
+        if type(c) in VERTICAL_CANCELLATIONS:
+            coefficients.append(_cancelled(c))
         else:
             coefficients.append(c)
     return Graph(coefficients, x.traces)
 
 
+def find_vertical_cancellations(terms: Sequence[Graph]) -> list[tuple[int, int]]:
+    # Every pair (i, j) such that terms[i] and terms[j] cancel vertically, with terms[i]
+    # the one with the product. Terms are indexed by their signatures with the cancelling
+    # coefficient masked out, so apart from the pairs themselves this is linear in the
+    # number of terms
+    index = _signature_index([_masked_signatures(x) for x in terms])
+    return sorted(
+        [
+            (i, j)
+            for products, identities in index.values()
+            for i, _ in products
+            for j, _ in identities
+        ]
+    )
+
+
+def cancel_vertically(
+    terms: Iterable[Graph],
+) -> tuple[list[Graph], list[VerticalCancellation]]:
+    # Replaces pairs of terms that cancel vertically by their sum until none are left,
+    # and reports the cancellations. In each round, the terms are taken in order, and
+    # each is paired with the first later term that isn't paired yet and cancels with
+    # its first coefficient that has one. The sum takes the place of the earlier term
+    terms = list(terms)
+    cancellations: list[VerticalCancellation] = []
+    while True:
+        signatures = [_masked_signatures(x) for x in terms]
+        index = _signature_index(signatures)
+
+        merged: dict[int, Graph] = {}
+        paired: set[int] = set()
+        done: set[int] = set()
+        for i, x_signatures in enumerate(signatures):
+            if i in done:
+                continue
+            done.add(i)
+            for is_product, k, signature in x_signatures:
+                partners = index[signature][1 if is_product else 0]
+                # Terms that are done are paired or have no partner left
+                while partners and partners[0][0] in done:
+                    partners.popleft()
+                if not partners:
+                    continue
+
+                j, l = partners.popleft()
+                done.add(j)
+                paired.add(j)
+                product_term, identity_term = terms[i], terms[j]
+                if not is_product:
+                    product_term, identity_term, k = terms[j], terms[i], l
+                merged[i] = _merge(product_term, k)
+                cancellations.append(
+                    VerticalCancellation(product_term, identity_term, merged[i])
+                )
+                break
+
+        if not merged:
+            return terms, cancellations
+        terms = [merged.get(i, x) for i, x in enumerate(terms) if i not in paired]
+
+
+# A masked signature of a term: the class of the product of the cancelling coefficient,
+# its indices, and the coefficients and traces of the term without it
+Signature = tuple[type[Coefficient], frozenset, frozenset, frozenset]
+
+
+def _masked_signatures(x: Graph) -> list[tuple[bool, int, Signature]]:
+    # For each coefficient of x that can cancel vertically, whether it is the product,
+    # its position and the signature of x without it
+    out: list[tuple[bool, int, Signature]] = []
+    seen: set[tuple[bool, Signature]] = set()
+    traces = frozenset(Counter(x.traces).items())
+    coefficients = Counter(x.coefficients)
+    for k, c in enumerate(x.coefficients):
+        role = _vertical_roles.get(type(c))
+        if role is None:
+            continue
+        is_product, product = role
+        coefficients[c] -= 1
+        signature = (
+            product,
+            frozenset(c.indices),
+            frozenset((+coefficients).items()),
+            traces,
+        )
+        coefficients[c] += 1
+        if (is_product, signature) not in seen:
+            seen.add((is_product, signature))
+            out.append((is_product, k, signature))
+    return out
+
+
+def _signature_index(
+    signatures: list[list[tuple[bool, int, Signature]]],
+) -> dict[Signature, tuple[deque[tuple[int, int]], deque[tuple[int, int]]]]:
+    # The terms with the product and the terms with the identity for each signature, as
+    # (term, position of the coefficient) in the order of the terms
+    index: dict[Signature, tuple[deque, deque]] = defaultdict(
+        lambda: (deque(), deque())
+    )
+    for i, x_signatures in enumerate(signatures):
+        for is_product, k, signature in x_signatures:
+            index[signature][0 if is_product else 1].append((i, k))
+    return index
+
+
+def _merge(product_term: Graph, k: int) -> Graph:
+    # The sum of product_term and the term with the identity instead of its k-th
+    # coefficient
+    coefficients = list(product_term.coefficients)
+    coefficients[k] = _cancelled(coefficients[k])
+    return Graph(coefficients, product_term.traces)
+
+
+def _cancelled(c: Coefficient) -> Coefficient:
+    cls = VERTICAL_CANCELLATIONS[type(c)][1]
+    return cls(c.charges[0], c.charges[1], c.i, c.j)
+
+
+# Products of coefficients, as the classes of the left and right factors, the class of
+# the product, the factor whose charges it takes and whether the charges of the factors
+# have to agree. The left factor is contracted on its second index and the right factor
+# on its first index. Charges don't have to align for \M S, but this means that it
+# should pair with a \Theta somewhere. Every product has a class of its own (see the
+# TODO in Coefficient.py), so a pair of classes with no row here is not multiplied, and
+# contract_coefficients leaves it as it is
+PRODUCTS: list[
+    tuple[type[Coefficient], type[Coefficient], type[Coefficient], int, bool]
+] = [
+    (calM, S, calMS, 0, False),
+    (S, Theta, STheta, 1, False),
+    (Theta, calM, ThetacalM, 0, True),
+    (calM, STheta, ThetacalMS, 1, True),
+    (STheta, Theta, SThetaTheta, 0, True),
+    (ThetacalM, S, ThetacalMS, 0, False),
+    (ThetacalM, STheta, ThetacalMSTheta, 0, True),
+    (S, ThetacalMS, SThetacalMS, 1, False),
+    (STheta, calMS, SThetacalMS, 0, False),
+    (SThetacalMS, Theta, SThetacalMSTheta, 0, True),
+    (SThetacalMS, ThetacalMS, SThetacalMSThetacalMS, 0, True),
+    (ThetacalM, SThetacalMS, ThetacalMSThetacalMS, 0, True),
+    (S, ThetacalMSTheta, SThetacalMSTheta, 1, False),
+    (STheta, ThetacalMS, SThetaThetaMS, 0, True),
+    (ThetacalMS, ThetacalM, ThetacalMSThetacalM, 1, True),
+]
+_products = {
+    (left, right): (product, charges, check_charges)
+    for left, right, product, charges, check_charges in PRODUCTS
+}
+
+
+@cache
+def _product_rule(
+    type1: type[Coefficient], type2: type[Coefficient]
+) -> Optional[tuple[bool, type[Coefficient], int, bool]]:
+    # Whether the factors are swapped, and the class of the product
+    for swapped, key in [(False, (type1, type2)), (True, (type2, type1))]:
+        rule = _products.get(key)
+        if rule is not None:
+            return swapped, *rule
+    return None
+
+
 def single_matrix_multiplication(
     c1: Coefficient, c2: Coefficient
 ) -> Optional[Coefficient]:
     if not set(c1.indices) & set(c2.indices):
         return None
 
-    for d1, d2 in [(c1, c2), (c2, c1)]:
-        if isinstance(d1, calM) and isinstance(d2, S):
-            if d1.i in set(d2.indices):
-                d1 = d1.transpose()
-            if d1.j != d2.i:
-                d2 = d2.transpose()
-            return calMS(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, Theta) and isinstance(d2, S):
-            assert d1.i in set(d2.indices)
-            if d2.j != d1.i:
-                d2 = d2.transpose()
-            return STheta(d1.charges[0], d1.charges[1], d2.i, d1.j)
-
-        if isinstance(d1, Theta) and isinstance(d2, calM):
-            assert d1.j in set(d2.indices)
-            if d1.j != d2.i:
-                d2 = d2.transpose()
-            assert d1.charges == d2.charges
-            return ThetacalM(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, Theta) and isinstance(d2, calMS):
-            if d1.i == d2.i:
-                d2 = d2.transpose()
-                assert d1.charges == d2.charges
-                return ThetacalMS(d1.charges[0], d1.charges[1], d2.i, d1.j)
-            elif d1.j == d2.j:
-                d2 = d2.transpose()
-                assert d1.charges == d2.charges
-                return ThetacalMS(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, STheta) and isinstance(d2, calM):
-            if d1.j in set(d2.indices):
-                d1 = d1.transpose()
-            if d2.j != d1.i:
-                d2 = d2.transpose()
-            assert d1.charges == d2.charges
-            return ThetacalMS(d1.charges[0], d1.charges[1], d2.i, d1.j)
-
-        if isinstance(d1, STheta) and isinstance(d2, Theta):
-            assert d2.i in set(d1.indices)
-            if d1.i in set(d2.indices):
-                d1 = d1.transpose()
-            assert d1.charges == d2.charges
-            return SThetaTheta(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, ThetacalM) and isinstance(d2, S):
-            if d1.i in set(d2.indices):
-                d1 = d1.transpose()
-            if d1.j != d2.i:
-                d2 = d2.transpose()
-            return ThetacalMS(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, ThetacalM) and isinstance(d2, STheta):
-            if d1.i in set(d2.indices):
-                d1 = d1.transpose()
-            if d1.j != d2.i:
-                d2 = d2.transpose()
-            assert d1.charges == d2.charges
-            return ThetacalMSTheta(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, ThetacalMS) and isinstance(d2, S):
-            assert d1.i in set(d2.indices)
-            if d2.i in set(d1.indices):
-                d2 = d2.transpose()
-            return SThetacalMS(d1.charges[0], d1.charges[1], d2.i, d1.j)
-
-        if isinstance(d1, STheta) and isinstance(d2, calMS):
-            assert d2.i in set(d1.indices)
-            if d1.j != d2.i:
-                d1 = d1.transpose()
-            return SThetacalMS(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, SThetacalMS) and isinstance(d2, Theta):
-            assert d2.i in set(d1.indices)
-            if d1.i in set(d2.indices):
-                d1 = d1.transpose()
-            assert d1.charges == d2.charges
-            return SThetacalMSTheta(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, SThetacalMS) and isinstance(d2, ThetacalMS):
-            if d1.i in set(d2.indices):
-                d1 = d1.transpose()
-            assert d1.j == d2.i and d1.charges == d2.charges
-            return SThetacalMSThetacalMS(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, ThetacalM) and isinstance(d2, SThetacalMS):
-            if d1.i in set(d2.indices):
-                d1 = d1.transpose()
-            if d1.j != d2.i:
-                d2 = d2.transpose()
-            assert d1.charges == d2.charges
-            return ThetacalMSThetacalMS(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, ThetacalMSTheta) and isinstance(d2, S):
-            assert d1.i in set(d2.indices)
-            if d2.j != d1.i:
-                d2 = d2.transpose()
-            return SThetacalMSTheta(d1.charges[0], d1.charges[1], d2.i, d1.j)
-
-        if isinstance(d1, STheta) and isinstance(d2, ThetacalMS):
-            assert d2.i in set(d1.indices)
-            if d1.j != d2.i:
-                d1 = d1.transpose()
-            assert d1.charges == d2.charges
-            return SThetaThetaMS(d1.charges[0], d1.charges[1], d1.i, d2.j)
-
-        if isinstance(d1, ThetacalM) and isinstance(d2, ThetacalMS):
-            assert d2.j in set(d1.indices)
-            if d2.j != d1.i:
-                d1 = d1.transpose()
-            assert d1.charges == d2.charges
-            return ThetacalMSThetacalM(d1.charges[0], d1.charges[1], d2.i, d1.j)
-
-        # Charges don't have to align, but this means that calMS should pair with a Theta somewhere
-        # if isinstance(d1, ThetacalMS) and isinstance(d2, calMS):
-        #     assert d1.charges == d2.charges
-        #     if d1.i == d2.j:
-        #         return SThetacalMSTheta(d1.charges[0], d1.charges[1], d2.i, d1.j)
-        #     elif d1.j == d2.i:
-        #         return SThetacalMSTheta(d1.charges[0], d1.charges[1], d1.i, d2.j)
+    rule = _product_rule(type(c1), type(c2))
+    if rule is None:
+        return None
+
+    swapped, product, charges, check_charges = rule
+    left, right = (c2, c1) if swapped else (c1, c2)
+    if left.j not in set(right.indices):
+        left = left.transpose()
+    if right.i != left.j:
+        right = right.transpose()
+    assert right.i == left.j
+    assert not check_charges or left.charges == right.charges
+
+    charge1, charge2 = (left, right)[charges].charges
+    return product(charge1, charge2, left.i, right.j)
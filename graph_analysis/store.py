@@ -0,0 +1,386 @@
+from typing import Iterable, Iterator, overload
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+from graph_expansion import *
+
+# Columnar storage for large lists of graphs. Every coefficient, trace and matrix factor
+# is a row of a few flat integer arrays, and each graph owns a contiguous range of
+# them, given by offsets:
+#
+#   graph i:        coefficients[coefficient_offsets[i] : coefficient_offsets[i + 1]]
+#                   traces[trace_offsets[i] : trace_offsets[i + 1]]
+#   trace t:        factors[factor_offsets[t] : factor_offsets[t + 1]]
+#
+# Types and symbols are stored as ids into tables shared by a store and the stores
+# sliced from it. Graphs are only built again when they are accessed
+
+CHARGES: tuple[Charge, ...] = tuple(Charge)
+CHARGE_CODES: dict[Charge, int] = {charge: i for i, charge in enumerate(CHARGES)}
+NO_CHARGE = -1
+NO_INDEX = -1
+
+# Kinds of traces, as classified by Graph
+DETERMINISTIC = 0
+LIGHT_WEIGHT = 1
+G_LOOP = 2
+
+
+class _Table:
+    # Append-only list of distinct items, each identified by its position
+    __slots__ = ("_items", "_ids")
+    _items: list
+    _ids: dict
+
+    def __init__(self):
+        self._items = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i: int):
+        return self._items[i]
+
+    def id(self, item) -> int:
+        i = self._ids.get(item)
+        if i is None:
+            i = self._ids[item] = len(self._items)
+            self._items.append(item)
+        return i
+
+    def ids(self, predicate) -> NDArray[np.int64]:
+        return np.array(
+            [i for i, item in enumerate(self._items) if predicate(item)], dtype=np.int64
+        )
+
+    def mask(self, predicate) -> NDArray[np.bool_]:
+        return np.array([predicate(item) for item in self._items], dtype=np.bool_)
+
+
+class _Column:
+    # Integer array with amortized O(1) appends
+    __slots__ = ("_data", "_size")
+    _data: NDArray
+    _size: int
+
+    def __init__(self, data: NDArray):
+        self._data = data
+        self._size = len(data)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def values(self) -> NDArray:
+        return self._data[: self._size]
+
+    def extend(self, rows: list) -> None:
+        n = len(rows)
+        if not n:
+            return
+        if self._size + n > len(self._data):
+            capacity = max(2 * len(self._data), self._size + n, 16)
+            data = np.empty((capacity,) + self._data.shape[1:], dtype=self._data.dtype)
+            data[: self._size] = self.values
+            self._data = data
+        self._data[self._size : self._size + n] = rows
+        self._size += n
+
+
+class TermStore:
+    __slots__ = (
+        "_symbols",
+        "_coefficient_classes",
+        "_factor_classes",
+        "_coefficient_offsets",
+        "_coefficient_types",
+        "_coefficient_charges",
+        "_coefficient_indices",
+        "_trace_offsets",
+        "_trace_kinds",
+        "_factor_offsets",
+        "_factor_types",
+        "_factor_charges",
+        "_factor_indices",
+    )
+    _symbols: _Table
+    _coefficient_classes: _Table
+    _factor_classes: _Table
+    # One row per graph, plus a leading 0
+    _coefficient_offsets: _Column
+    _trace_offsets: _Column
+    # One row per coefficient
+    _coefficient_types: _Column
+    _coefficient_charges: _Column
+    _coefficient_indices: _Column
+    # One row per trace, plus a leading 0 for the offsets
+    _trace_kinds: _Column
+    _factor_offsets: _Column
+    # One row per matrix factor
+    _factor_types: _Column
+    _factor_charges: _Column
+    _factor_indices: _Column
+
+    def __init__(self, graphs: Iterable[Graph] = ()):
+        self._symbols = _Table()
+        self._coefficient_classes = _Table()
+        self._factor_classes = _Table()
+        self._coefficient_offsets = _Column(np.zeros(1, dtype=np.int64))
+        self._coefficient_types = _Column(np.empty(0, dtype=np.int16))
+        self._coefficient_charges = _Column(np.empty((0, 2), dtype=np.int8))
+        self._coefficient_indices = _Column(np.empty((0, 2), dtype=np.int32))
+        self._trace_offsets = _Column(np.zeros(1, dtype=np.int64))
+        self._trace_kinds = _Column(np.empty(0, dtype=np.int8))
+        self._factor_offsets = _Column(np.zeros(1, dtype=np.int64))
+        self._factor_types = _Column(np.empty(0, dtype=np.int16))
+        self._factor_charges = _Column(np.empty(0, dtype=np.int8))
+        self._factor_indices = _Column(np.empty(0, dtype=np.int32))
+        self.extend(graphs)
+
+    def __len__(self):
+        return len(self._coefficient_offsets) - 1
+
+    def __iter__(self) -> Iterator[Graph]:
+        for i in range(len(self)):
+            yield self.graph(i)
+
+    @overload
+    def __getitem__(self, key: int) -> Graph: ...
+
+    @overload
+    def __getitem__(self, key: slice | ArrayLike) -> "TermStore": ...
+
+    def __getitem__(self, key):
+        if isinstance(key, int | np.integer):
+            return self.graph(int(key))
+        return self.take(np.arange(len(self))[key])
+
+    def append(self, x: Graph) -> None:
+        self.extend([x])
+
+    def extend(self, graphs: Iterable[Graph]) -> None:
+        coefficient_offsets: list[int] = []
+        coefficient_types: list[int] = []
+        coefficient_charges: list[tuple[int, int]] = []
+        coefficient_indices: list[tuple[int, int]] = []
+        trace_offsets: list[int] = []
+        trace_kinds: list[int] = []
+        factor_offsets: list[int] = []
+        factor_types: list[int] = []
+        factor_charges: list[int] = []
+        factor_indices: list[int] = []
+
+        n_coefficients = len(self._coefficient_types)
+        n_traces = len(self._trace_kinds)
+        n_factors = len(self._factor_types)
+        for x in graphs:
+            for c in x.coefficients:
+                coefficient_types.append(self._coefficient_classes.id(type(c)))
+                if isinstance(c, ChargedCoefficient):
+                    coefficient_charges.append(
+                        (CHARGE_CODES[c.charges[0]], CHARGE_CODES[c.charges[1]])
+                    )
+                else:
+                    coefficient_charges.append((NO_CHARGE, NO_CHARGE))
+                coefficient_indices.append(
+                    (self._symbols.id(c.i), self._symbols.id(c.j))
+                )
+            n_coefficients += len(x.coefficients)
+            coefficient_offsets.append(n_coefficients)
+
+            for t in x.traces:
+                if t.n_G == 0 and t.n_wtG == 0:
+                    trace_kinds.append(DETERMINISTIC)
+                elif t.n_G == 0:
+                    trace_kinds.append(LIGHT_WEIGHT)
+                else:
+                    trace_kinds.append(G_LOOP)
+                for f in t:
+                    factor_types.append(self._factor_classes.id(type(f)))
+                    factor_charges.append(CHARGE_CODES[f.charge])
+                    factor_indices.append(
+                        self._symbols.id(f.i) if isinstance(f, E) else NO_INDEX
+                    )
+                n_factors += len(t)
+                factor_offsets.append(n_factors)
+            n_traces += len(x.traces)
+            trace_offsets.append(n_traces)
+
+        self._coefficient_offsets.extend(coefficient_offsets)
+        self._coefficient_types.extend(coefficient_types)
+        self._coefficient_charges.extend(coefficient_charges)
+        self._coefficient_indices.extend(coefficient_indices)
+        self._trace_offsets.extend(trace_offsets)
+        self._trace_kinds.extend(trace_kinds)
+        self._factor_offsets.extend(factor_offsets)
+        self._factor_types.extend(factor_types)
+        self._factor_charges.extend(factor_charges)
+        self._factor_indices.extend(factor_indices)
+
+    def graph(self, i: int) -> Graph:
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"TermStore index {i} out of range")
+        i %= len(self)
+        coefficient_offsets = self._coefficient_offsets.values
+        trace_offsets = self._trace_offsets.values
+        return Graph(
+            [
+                self._coefficient(j)
+                for j in range(coefficient_offsets[i], coefficient_offsets[i + 1])
+            ],
+            [self._trace(t) for t in range(trace_offsets[i], trace_offsets[i + 1])],
+        )
+
+    def take(self, rows: ArrayLike) -> "TermStore":
+        rows = np.asarray(rows, dtype=np.int64)
+        coefficient_rows, coefficient_offsets = _ranges(
+            self._coefficient_offsets.values, rows
+        )
+        trace_rows, trace_offsets = _ranges(self._trace_offsets.values, rows)
+        factor_rows, factor_offsets = _ranges(self._factor_offsets.values, trace_rows)
+
+        out = TermStore.__new__(TermStore)
+        out._symbols = self._symbols
+        out._coefficient_classes = self._coefficient_classes
+        out._factor_classes = self._factor_classes
+        out._coefficient_offsets = _Column(coefficient_offsets)
+        out._coefficient_types = _Column(
+            self._coefficient_types.values[coefficient_rows]
+        )
+        out._coefficient_charges = _Column(
+            self._coefficient_charges.values[coefficient_rows]
+        )
+        out._coefficient_indices = _Column(
+            self._coefficient_indices.values[coefficient_rows]
+        )
+        out._trace_offsets = _Column(trace_offsets)
+        out._trace_kinds = _Column(self._trace_kinds.values[trace_rows])
+        out._factor_offsets = _Column(factor_offsets)
+        out._factor_types = _Column(self._factor_types.values[factor_rows])
+        out._factor_charges = _Column(self._factor_charges.values[factor_rows])
+        out._factor_indices = _Column(self._factor_indices.values[factor_rows])
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        # Memory used by the arrays, not counting spare capacity or the shared tables
+        return sum(
+            [
+                getattr(self, name).values.nbytes
+                for name in self.__slots__
+                if isinstance(getattr(self, name), _Column)
+            ]
+        )
+
+    # Vectorized invariants, one entry per graph
+
+    def p(self) -> NDArray[np.int64]:
+        return self._count_coefficients(self._coefficient_type_mask(S))
+
+    def q(self) -> NDArray[np.int64]:
+        return self._count_traces(self._trace_kinds.values == LIGHT_WEIGHT)
+
+    def r(self) -> NDArray[np.int64]:
+        return self._count_traces(self._trace_kinds.values == G_LOOP)
+
+    def n(self) -> NDArray[np.int64]:
+        factor_traces = _owners(self._factor_offsets.values)
+        is_G = np.isin(
+            self._factor_types.values,
+            self._factor_classes.ids(lambda cls: issubclass(cls, G)),
+        )
+        in_g_loop = self._trace_kinds.values[factor_traces] == G_LOOP
+        return np.bincount(
+            _owners(self._trace_offsets.values)[factor_traces[is_G & in_g_loop]],
+            minlength=len(self),
+        )
+
+    def size(self) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+        # The n_exponent and eta_exponent of size(x)
+        p, q, r, n = self.p(), self.q(), self.r(), self.n()
+        charges = self._coefficient_charges.values
+        long_thetas = self._coefficient_type_mask(Theta) & (
+            charges[:, 0] != charges[:, 1]
+        )
+        return -(p + q), r - q - n - self._count_coefficients(long_thetas)
+
+    def order(self) -> NDArray[np.int64]:
+        trace_graphs = _owners(self._trace_offsets.values)
+        kinds = self._trace_kinds.values
+        trace_orders = np.diff(self._factor_offsets.values) // 2 - (
+            kinds != LIGHT_WEIGHT
+        )
+        orders = np.zeros(len(self), dtype=np.int64)
+        np.add.at(orders, trace_graphs, trace_orders)
+        orders += np.diff(self._coefficient_offsets.values)
+
+        # Distinct b indices on the coefficients and G-loops of each graph
+        is_b = self._symbols.mask(lambda i: isinstance(i, b))
+        coefficient_graphs = np.repeat(_owners(self._coefficient_offsets.values), 2)
+        coefficient_indices = self._coefficient_indices.values.reshape(-1)
+        factor_traces = _owners(self._factor_offsets.values)
+        factor_indices = self._factor_indices.values
+        in_g_loop = (kinds[factor_traces] == G_LOOP) & (factor_indices != NO_INDEX)
+        graphs = np.concatenate(
+            [coefficient_graphs, trace_graphs[factor_traces[in_g_loop]]]
+        )
+        indices = np.concatenate([coefficient_indices, factor_indices[in_g_loop]])
+        keep = is_b[indices]
+        n_symbols = max(len(self._symbols), 1)
+        pairs = np.unique(graphs[keep] * n_symbols + indices[keep])
+        orders -= np.bincount(pairs // n_symbols, minlength=len(self))
+        return orders
+
+    # Helpers
+
+    def _coefficient(self, k: int) -> Coefficient:
+        cls = self._coefficient_classes[self._coefficient_types.values[k]]
+        i, j = [self._symbols[index] for index in self._coefficient_indices.values[k]]
+        charge1, charge2 = self._coefficient_charges.values[k]
+        if charge1 == NO_CHARGE:
+            return cls(i, j)
+        return cls(CHARGES[charge1], CHARGES[charge2], i, j)
+
+    def _trace(self, t: int) -> Trace:
+        factor_offsets = self._factor_offsets.values
+        factors: list[MatrixFactor] = []
+        for k in range(factor_offsets[t], factor_offsets[t + 1]):
+            cls = self._factor_classes[self._factor_types.values[k]]
+            if cls is E:
+                factors.append(E(self._symbols[self._factor_indices.values[k]]))
+            else:
+                factors.append(cls(CHARGES[self._factor_charges.values[k]]))
+        return Trace(factors)
+
+    def _coefficient_type_mask(self, cls: type) -> NDArray[np.bool_]:
+        return np.isin(
+            self._coefficient_types.values,
+            self._coefficient_classes.ids(lambda c: issubclass(c, cls)),
+        )
+
+    def _count_coefficients(self, mask: NDArray[np.bool_]) -> NDArray[np.int64]:
+        owners = _owners(self._coefficient_offsets.values)
+        return np.bincount(owners[mask], minlength=len(self))
+
+    def _count_traces(self, mask: NDArray[np.bool_]) -> NDArray[np.int64]:
+        owners = _owners(self._trace_offsets.values)
+        return np.bincount(owners[mask], minlength=len(self))
+
+
+def _owners(offsets: NDArray[np.int64]) -> NDArray[np.int64]:
+    # Row of the owner of each entry
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _ranges(
+    offsets: NDArray[np.int64], rows: NDArray[np.int64]
+) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    # Entries owned by rows, in order, and the offsets of rows among them
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    entries = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return entries, new_offsets
@@ -4,7 +4,10 @@ from .Texable import Texable, tex
 
 
 class Coefficient(Texable):
+    __slots__ = ("_indices",)
     _indices: tuple[Symbol, Symbol]
+    # True if __eq__ also matches the transposed coefficient
+    _symmetric = False
 
     def __init__(
         self,
@@ -18,6 +21,9 @@ class Coefficient(Texable):
             return False
         return self._indices == other._indices
 
+    def __hash__(self):
+        return hash((type(self), self._indices))
+
     def __mul__(self, other):
         raise NotImplementedError("__mul__ not implemented on Coefficient")
 
@@ -35,6 +41,11 @@ class Coefficient(Texable):
     def j(self):
         return self._indices[1]
 
+    @property
+    def key(self) -> tuple:
+        # Totally ordered structural key, consistent with __eq__
+        return (type(self).__name__, self.i.value, self.j.value)
+
     @property
     def n_thetas(self) -> int:
         raise NotImplementedError("n_thetas() not implemented on Coefficient")
@@ -44,6 +55,7 @@ class Coefficient(Texable):
 
 
 class ChargedCoefficient(Coefficient):
+    __slots__ = ("_charges",)
     _charges: tuple[Charge, Charge]
 
     def __init__(self, charge1: Charge, charge2: Charge, i: Symbol, j: Symbol):
@@ -55,12 +67,40 @@ class ChargedCoefficient(Coefficient):
             return False
         return self._charges == other._charges and self._indices == other._indices
 
+    def __hash__(self):
+        return hash((type(self), self._charges, self._indices))
+
+    def _symmetric_hash(self):
+        # Consistent with an __eq__ that also matches the transposed coefficient
+        return hash(
+            (
+                type(self),
+                frozenset(
+                    [
+                        (self._charges, self._indices),
+                        (self._charges[::-1], self._indices[::-1]),
+                    ]
+                ),
+            )
+        )
+
     @property
     def charges(self):
         return (self._charges[0], self._charges[1])
 
+    @property
+    def key(self) -> tuple:
+        name = type(self).__name__
+        charge1, charge2 = self._charges[0].name, self._charges[1].name
+        key = (name, charge1, charge2, self.i.value, self.j.value)
+        if self._symmetric:
+            return min(key, (name, charge2, charge1, self.j.value, self.i.value))
+        return key
+
 
 class S(Coefficient):
+    __slots__ = ()
+
     def __tex__(self):
         return Rf"S_{{{tex(self.i)} {tex(self.j)}}}"
 
@@ -73,6 +113,8 @@ class S(Coefficient):
 
 
 class I(Coefficient):
+    __slots__ = ()
+
     def __tex__(self):
         return Rf"I_{{{tex(self.i)} {tex(self.j)}}}"
 
@@ -85,6 +127,8 @@ class I(Coefficient):
 
 
 class Theta(ChargedCoefficient):
+    __slots__ = ()
+
     def __tex__(self):
         return Rf"\Theta^{{\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}}}_{{{tex(self.i)}{tex(self.j)}}}"
 
@@ -97,6 +141,8 @@ class Theta(ChargedCoefficient):
 
 
 class calM(ChargedCoefficient):
+    __slots__ = ()
+
     def __tex__(self):
         return Rf"\M^{{\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}}}_{{{tex(self.i)}{tex(self.j)}}}"
 
@@ -109,6 +155,8 @@ class calM(ChargedCoefficient):
 
 
 class calMS(ChargedCoefficient):
+    __slots__ = ()
+
     def __tex__(self):
         return Rf"\p{{\M^{{\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}}}S}}_{{{tex(self.i)}{tex(self.j)}}}"
 
@@ -121,6 +169,8 @@ class calMS(ChargedCoefficient):
 
 
 class ThetacalM(ChargedCoefficient):
+    __slots__ = ()
+
     def __tex__(self):
         charge_string = (
             Rf"\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}"
@@ -136,6 +186,8 @@ class ThetacalM(ChargedCoefficient):
 
 
 class STheta(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -143,7 +195,7 @@ class STheta(ChargedCoefficient):
         return Rf"\p{{S\Theta^{{\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}}}}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -154,6 +206,8 @@ class STheta(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 1
@@ -166,6 +220,8 @@ class STheta(ChargedCoefficient):
 
 
 class ThetacalMS(ChargedCoefficient):
+    __slots__ = ()
+
     def __tex__(self):
         charge_string = (
             Rf"\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}"
@@ -181,6 +237,8 @@ class ThetacalMS(ChargedCoefficient):
 
 
 class ThetacalMSTheta(ChargedCoefficient):
+    __slots__ = ()
+
     def __tex__(self):
         charge_string = (
             Rf"\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}"
@@ -196,6 +254,8 @@ class ThetacalMSTheta(ChargedCoefficient):
 
 
 class SThetacalMS(ChargedCoefficient):
+    __slots__ = ()
+
     def __tex__(self):
         charge_string = (
             Rf"\p{{{tex(self.charges[0].value)}, {tex(self.charges[1].value)}}}"
@@ -211,6 +271,8 @@ class SThetacalMS(ChargedCoefficient):
 
 
 class SThetaTheta(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -221,7 +283,7 @@ class SThetaTheta(ChargedCoefficient):
         return Rf"\p{{S\Theta^{{{charge_string}}}\Theta^{{{charge_string}}}}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -232,6 +294,8 @@ class SThetaTheta(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 2
@@ -241,6 +305,8 @@ class SThetaTheta(ChargedCoefficient):
 
 
 class SThetaThetaMS(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -251,7 +317,7 @@ class SThetaThetaMS(ChargedCoefficient):
         return Rf"\p{{S\Theta^{{{charge_string}}}\Theta^{{{charge_string}}}\M^{{{charge_string}}}S}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -262,6 +328,8 @@ class SThetaThetaMS(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 2
@@ -271,6 +339,8 @@ class SThetaThetaMS(ChargedCoefficient):
 
 
 class SThetacalMSTheta(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -281,7 +351,7 @@ class SThetacalMSTheta(ChargedCoefficient):
         return Rf"\p{{S\Theta^{{{charge_string}}}\M^{{{charge_string}}}S\Theta^{{{charge_string}}}}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -292,6 +362,8 @@ class SThetacalMSTheta(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 2
@@ -301,6 +373,8 @@ class SThetacalMSTheta(ChargedCoefficient):
 
 
 class ThetacalMScalMS(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -311,7 +385,7 @@ class ThetacalMScalMS(ChargedCoefficient):
         return Rf"\p{{\Theta^{{{charge_string}}}\M^{{{charge_string}}}S\M^{{{charge_string}}}S}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -322,6 +396,8 @@ class ThetacalMScalMS(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 1
@@ -331,6 +407,8 @@ class ThetacalMScalMS(ChargedCoefficient):
 
 
 class SThetacalMSThetacalMS(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -341,7 +419,7 @@ class SThetacalMSThetacalMS(ChargedCoefficient):
         return Rf"\p{{S\Theta^{{{charge_string}}}\M^{{{charge_string}}}S\Theta^{{{charge_string}}}\M^{{{charge_string}}}S}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -352,6 +430,8 @@ class SThetacalMSThetacalMS(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 2
@@ -361,6 +441,8 @@ class SThetacalMSThetacalMS(ChargedCoefficient):
 
 
 class ThetacalMSThetacalMS(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -371,7 +453,7 @@ class ThetacalMSThetacalMS(ChargedCoefficient):
         return Rf"\p{{\Theta^{{{charge_string}}}\M^{{{charge_string}}}S\Theta^{{{charge_string}}}\M^{{{charge_string}}}S}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -382,6 +464,8 @@ class ThetacalMSThetacalMS(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 2
@@ -391,6 +475,8 @@ class ThetacalMSThetacalMS(ChargedCoefficient):
 
 
 class ThetacalMSThetacalM(ChargedCoefficient):
+    __slots__ = ()
+    _symmetric = True
     _charges: tuple[Charge, Charge]
     _indices: tuple[Symbol, Symbol]
 
@@ -401,7 +487,7 @@ class ThetacalMSThetacalM(ChargedCoefficient):
         return Rf"\p{{\Theta^{{{charge_string}}}\M^{{{charge_string}}}S\Theta^{{{charge_string}}}\M^{{{charge_string}}}}}_{{{tex(self.i)}{tex(self.j)}}}"
 
     def __eq__(self, other):
-        if not isinstance(other, STheta):
+        if not isinstance(other, self.__class__):
             return False
         return (
             self._charges == other._charges
@@ -412,6 +498,8 @@ class ThetacalMSThetacalM(ChargedCoefficient):
             )
         )
 
+    __hash__ = ChargedCoefficient._symmetric_hash
+
     @property
     def n_thetas(self) -> int:
         return 2
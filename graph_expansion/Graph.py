@@ -1,13 +1,44 @@
-from copy import deepcopy
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Callable, Sequence, TypeVar
 
-from .Coefficient import Coefficient, STheta, Theta, calM
+from .Coefficient import Coefficient, S, STheta, Theta, calM
 from .MatrixFactor import E, G, M, MatrixFactor, wtG
-from .Symbol import Symbol, a
+from .Symbol import Symbol, a, b
 from .Texable import Texable, render, tex
 
+Item = TypeVar("Item")
+
+
+def least_rotation(keys: Sequence) -> int:
+    # Booth's algorithm: start index of the lexicographically least rotation in O(n)
+    n = len(keys)
+    failure = [-1] * (2 * n)
+    k = 0
+    for j in range(1, 2 * n):
+        key_j = keys[j % n]
+        i = failure[j - k - 1]
+        while i != -1 and key_j != keys[(k + i + 1) % n]:
+            if key_j < keys[(k + i + 1) % n]:
+                k = j - i - 1
+            i = failure[i]
+        if key_j != keys[(k + i + 1) % n]:
+            if key_j < keys[k % n]:
+                k = j
+            failure[j - k] = -1
+        else:
+            failure[j - k] = i + 1
+    return k % n if n else 0
+
 
 class Trace(Texable):
+    __slots__ = ("_factors", "_canonical", "_hash", "_n_G", "_n_wtG", "_b_indices")
     _factors: tuple[MatrixFactor, ...]
+    _canonical: tuple[MatrixFactor, ...]
+    _hash: int
+    _n_G: int
+    _n_wtG: int
+    _b_indices: frozenset[b]
 
     def __init__(self, *args):
         factors: list[MatrixFactor] = []
@@ -23,13 +54,24 @@ class Trace(Texable):
 
         self._factors = tuple(factors)
 
+        # Least cyclic rotation, so that equality up to rotation is a tuple comparison
+        i = least_rotation([f.key for f in self._factors])
+        self._canonical = self._factors[i:] + self._factors[:i]
+        self._hash = hash(self._canonical)
+
+        self._n_G = len([f for f in self._factors if isinstance(f, G)])
+        self._n_wtG = len([f for f in self._factors if isinstance(f, wtG)])
+        self._b_indices = frozenset(
+            [f.i for f in self._factors if isinstance(f, E) and isinstance(f.i, b)]
+        )
+
     def __eq__(self, other):
         if not isinstance(other, Trace):
             return False
-        for i in range(len(self._factors)):
-            if self._factors[i:] + self._factors[:i] == other._factors:
-                return True
-        return False
+        return self._hash == other._hash and self._canonical == other._canonical
+
+    def __hash__(self):
+        return self._hash
 
     def __mul__(self, other):
         raise NotImplementedError("__mul__ not implemented on Trace")
@@ -43,28 +85,88 @@ class Trace(Texable):
         return self._factors[i]
 
     def __iter__(self):
-        for f in deepcopy(self._factors):
-            yield f
+        return iter(self._factors)
 
     def __tex__(self):
         return f"\\avg{{{' '.join([tex(f) for f in self._factors])}}}"
 
     def __copy__(self):
-        return Trace(deepcopy(self._factors))
+        return self
+
+    def __getstate__(self):
+        # The hash depends on the process (str hashes and Symbol ids), so it is computed
+        # again when unpickling instead of being stored
+        return {
+            name: getattr(self, name) for name in Trace.__slots__ if name != "_hash"
+        }
+
+    def __setstate__(self, state: dict):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._hash = hash(self._canonical)
 
     def is_deterministic(self):
         return all([f.is_deterministic() for f in self._factors])
 
-    def cycle(self):
-        self._factors = self._factors[1:] + self._factors[:1]
+    def cycle(self, n: int = 1) -> "Trace":
+        n %= max(len(self._factors), 1)
+        out = Trace.__new__(Trace)
+        out._factors = self._factors[n:] + self._factors[:n]
+        out._canonical = self._canonical
+        out._hash = self._hash
+        out._n_G = self._n_G
+        out._n_wtG = self._n_wtG
+        out._b_indices = self._b_indices
+        return out
+
+    @property
+    def canonical(self):
+        return self._canonical
+
+    @property
+    def key(self) -> tuple:
+        return tuple(f.key for f in self._canonical)
+
+    @property
+    def n_G(self) -> int:
+        return self._n_G
+
+    @property
+    def n_wtG(self) -> int:
+        return self._n_wtG
+
+    @property
+    def b_indices(self) -> frozenset[b]:
+        return self._b_indices
 
 
 class Graph(Texable):
+    __slots__ = (
+        "_coefficients",
+        "_traces",
+        "_deterministics",
+        "_light_weights",
+        "_g_loops",
+        "_hash",
+        "_order",
+        "_b_indices",
+        "_max_b_index",
+        "_p",
+        "_n",
+    )
     _coefficients: tuple[Coefficient, ...]
     _traces: tuple[Trace, ...]
     _deterministics: tuple[Trace, ...]
     _light_weights: tuple[Trace, ...]
     _g_loops: tuple[Trace, ...]
+    _hash: int | None
+    # Invariants used on every node of the expansion tree, computed once from the
+    # invariants cached on each Trace (which children share with their parent)
+    _order: int
+    _b_indices: frozenset[b]
+    _max_b_index: int
+    _p: int
+    _n: int
 
     def __init__(self, *args):
         coefficients: list[Coefficient] = []
@@ -91,26 +193,19 @@ class Graph(Texable):
 
         traces_to_remove: list[Trace] = []
         for t in traces:
-            n_wtG = len([f for f in t if isinstance(f, wtG)])
-            n_G = len([f for f in t if isinstance(f, G)])
+            n_wtG = t.n_wtG
+            n_G = t.n_G
 
             if n_wtG == 0 and n_G == 0:
                 # Replace <ME_a ME_b> with \calM_{ab}
                 if len(t) == 4:
-                    M_1, M_2 = t[0], t[2]
-                    E_1, E_2 = t[1], t[3]
-                    assert isinstance(M_1, M) and isinstance(M_2, M)
-                    assert isinstance(E_1, E) and isinstance(E_2, E)
-                    next_calM = calM(M_1.charge, M_2.charge, E_1.i, E_2.i)
-                    if isinstance(next_calM.j, a):
-                        next_calM = next_calM.transpose()
-                    coefficients.append(next_calM)
+                    coefficients.append(to_calM(t))
                     traces_to_remove.append(t)
                 else:
                     deterministics.append(t)
             elif n_wtG == 0 and n_G > 1:
                 i = best_G_index(t)
-                t = Trace(t[i:] + t[:i])
+                t = t.cycle(i)
                 g_loops.append(t)
             elif n_wtG == 1 and n_G == 0:
                 light_weights.append(t)
@@ -121,28 +216,101 @@ class Graph(Texable):
         for t in traces_to_remove:
             traces.remove(t)
 
-        deterministics.sort(
-            key=lambda t: (
-                len(t),
-                max([f.i for f in t if isinstance(f, E)]),
-            )
-        )
-        coefficients.sort(
-            key=lambda c: (
-                min([c.i, c.j])  # if isinstance(c, Theta | STheta) else Symbol("")
-            )
-        )
-        g_loops.sort(key=lambda t: len([f for f in t if isinstance(f, G)]))
+        deterministics.sort(key=deterministic_sort_key)
+        coefficients.sort(key=coefficient_sort_key)
+        g_loops.sort(key=g_loop_sort_key)
+
+        self._set_parts(coefficients, traces, deterministics, light_weights, g_loops)
+
+    @classmethod
+    def from_parts(
+        cls,
+        coefficients: Sequence[Coefficient],
+        traces: Sequence[Trace],
+        deterministics: Sequence[Trace],
+        light_weights: Sequence[Trace],
+        g_loops: Sequence[Trace],
+    ) -> "Graph":
+        # Same graph as Graph(...), for callers that already have its parts in the form
+        # that Graph(...) stores them: deterministic traces of length 4 replaced by calM
+        # coefficients, G-loops rotated by best_G_index, each category sorted by its sort
+        # key and traces in the order they were given. Nothing is checked
+        out = cls.__new__(cls)
+        out._set_parts(coefficients, traces, deterministics, light_weights, g_loops)
+        return out
 
+    def _set_parts(
+        self,
+        coefficients: Sequence[Coefficient],
+        traces: Sequence[Trace],
+        deterministics: Sequence[Trace],
+        light_weights: Sequence[Trace],
+        g_loops: Sequence[Trace],
+    ):
         self._coefficients = tuple(coefficients)
         self._traces = tuple(traces)
         self._deterministics = tuple(deterministics)
         self._light_weights = tuple(light_weights)
         self._g_loops = tuple(g_loops)
+        self._hash = None
+
+        coefficient_indices: set[b] = set()
+        max_b_index = 0
+        for c in coefficients:
+            for i in c.indices:
+                if isinstance(i, b):
+                    coefficient_indices.add(i)
+                    if isinstance(c, S | Theta | STheta | calM):
+                        max_b_index = max(max_b_index, i.i)
+        trace_indices: set[b] = set().union(*[t.b_indices for t in traces])
+        g_loop_indices: set[b] = set().union(*[t.b_indices for t in g_loops])
+
+        self._order = (
+            sum([len(t) // 2 for t in light_weights])
+            + sum([len(t) // 2 - 1 for t in g_loops])
+            + sum([len(t) // 2 - 1 for t in deterministics])
+            + len(coefficients)
+            - len(coefficient_indices | g_loop_indices)
+        )
+        self._b_indices = frozenset(coefficient_indices | trace_indices)
+        self._max_b_index = max([max_b_index] + [i.i for i in trace_indices])
+        self._p = len([c for c in coefficients if isinstance(c, S)])
+        self._n = sum([t.n_G for t in g_loops])
+
+    def __eq__(self, other):
+        if not isinstance(other, Graph):
+            return False
+        if hash(self) != hash(other):
+            return False
+        return Counter(self._coefficients) == Counter(other._coefficients) and Counter(
+            self._traces
+        ) == Counter(other._traces)
+
+    def __hash__(self):
+        # Order-independent, since a Graph is a product of its coefficients and traces
+        if self._hash is None:
+            self._hash = hash(
+                (
+                    frozenset(Counter(self._coefficients).items()),
+                    frozenset(Counter(self._traces).items()),
+                )
+            )
+        return self._hash
 
     def __mul__(self, other):
         raise NotImplementedError("__mul__ not implemented on Graph")
 
+    def __getstate__(self):
+        # Like Trace, the cached hash is not stored
+        return {
+            name: getattr(self, name) for name in Graph.__slots__ if name != "_hash"
+        }
+
+    def __setstate__(self, state: dict):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._hash = None
+
     __rmul__ = __mul__
 
     def __tex__(self):
@@ -156,25 +324,61 @@ class Graph(Texable):
     def is_deterministic(self):
         return not self.light_weights and not self.g_loops
 
+    @property
+    def key(self) -> tuple:
+        # Structural key, consistent with __eq__
+        return (
+            tuple(sorted(c.key for c in self._coefficients)),
+            tuple(sorted(t.key for t in self._traces)),
+        )
+
+    @property
+    def order(self) -> int:
+        return self._order
+
+    @property
+    def b_indices(self) -> frozenset[b]:
+        return self._b_indices
+
+    @property
+    def max_b_index(self) -> int:
+        return self._max_b_index
+
+    @property
+    def p(self) -> int:
+        return self._p
+
+    @property
+    def q(self) -> int:
+        return len(self._light_weights)
+
+    @property
+    def r(self) -> int:
+        return len(self._g_loops)
+
+    @property
+    def n(self) -> int:
+        return self._n
+
     @property
     def coefficients(self):
-        return deepcopy(self._coefficients)
+        return self._coefficients
 
     @property
     def traces(self):
-        return deepcopy(self._traces)
+        return self._traces
 
     @property
     def deterministics(self):
-        return deepcopy(self._deterministics)
+        return self._deterministics
 
     @property
     def light_weights(self):
-        return deepcopy(self._light_weights)
+        return self._light_weights
 
     @property
     def g_loops(self):
-        return deepcopy(self._g_loops)
+        return self._g_loops
 
 
 class Size(Texable):
@@ -257,6 +461,47 @@ class Size(Texable):
         return (self.n_exponent, self.eta_exponent).__hash__()
 
 
+def to_calM(t: Trace) -> calM:
+    # <ME_a ME_b> -> \calM_{ab}
+    M_1, M_2 = t[0], t[2]
+    E_1, E_2 = t[1], t[3]
+    assert isinstance(M_1, M) and isinstance(M_2, M)
+    assert isinstance(E_1, E) and isinstance(E_2, E)
+    out = calM(M_1.charge, M_2.charge, E_1.i, E_2.i)
+    if isinstance(out.j, a):
+        out = out.transpose()
+    return out
+
+
+# Orders of the parts of a Graph
+def coefficient_sort_key(c: Coefficient) -> Symbol:
+    return min([c.i, c.j])
+
+
+def deterministic_sort_key(t: Trace) -> tuple[int, Symbol]:
+    return (len(t), max([f.i for f in t if isinstance(f, E)]))
+
+
+def g_loop_sort_key(t: Trace) -> int:
+    return t.n_G
+
+
+def merge_sorted(
+    first: Sequence[Item], second: Sequence[Item], key: Callable
+) -> list[Item]:
+    # Same as sorted([*first, *second], key=key) when first and second are sorted,
+    # using O(min(m, n) log(m + n)) comparisons
+    if len(first) <= len(second):
+        out = list(second)
+        for x in reversed(first):
+            out.insert(bisect_left(out, key(x), key=key), x)
+    else:
+        out = list(first)
+        for x in second:
+            out.insert(bisect_right(out, key(x), key=key), x)
+    return out
+
+
 def last_G_index(t: Trace) -> int:
     i = len(t) - 1
     while i > -1:
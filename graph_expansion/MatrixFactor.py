@@ -1,8 +1,11 @@
+from typing import Self
+
 from .Symbol import Charge, Symbol
 from .Texable import Texable, tex
 
 
 class MatrixFactor(Texable):
+    __slots__ = ("_charge",)
     _charge: Charge
 
     def __init__(self, charge: Charge = Charge.Plus, like=None):
@@ -11,11 +14,20 @@ class MatrixFactor(Texable):
         else:
             self._charge = charge
 
-    def __adjoint__(self):
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return False
+        return self._charge == other._charge
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __adjoint__(self) -> Self:
         if self.charge == Charge.Plus:
-            self._charge = Charge.Minus
+            return type(self)(Charge.Minus)
         elif self.charge == Charge.Minus:
-            self._charge = Charge.Plus
+            return type(self)(Charge.Plus)
+        return self
 
     def is_deterministic(self) -> bool:
         raise NotImplementedError("is_deterministic not implemented")
@@ -24,8 +36,15 @@ class MatrixFactor(Texable):
     def charge(self):
         return self._charge
 
+    @property
+    def key(self) -> tuple:
+        # Totally ordered structural key, used to canonicalize traces
+        return (type(self).__name__, self._charge.name)
+
 
 class G(MatrixFactor):
+    __slots__ = ()
+
     def __tex__(self):
         if self.charge == Charge.Plus:
             return "G"
@@ -37,6 +56,8 @@ class G(MatrixFactor):
 
 
 class wtG(MatrixFactor):
+    __slots__ = ()
+
     def __tex__(self):
         if self.charge == Charge.Plus:
             return R"\G"
@@ -48,22 +69,20 @@ class wtG(MatrixFactor):
 
 
 class M(MatrixFactor):
+    __slots__ = ()
+
     def __tex__(self):
         if self.charge == Charge.Plus:
             return R"M"
         else:
             return R"M^*"
 
-    def __eq__(self, other):
-        if not isinstance(other, M):
-            return False
-        return self.charge == other.charge
-
     def is_deterministic(self):
         return True
 
 
 class E(MatrixFactor):
+    __slots__ = ("_i",)
     _i: Symbol
 
     def __init__(self, i: Symbol):
@@ -78,9 +97,16 @@ class E(MatrixFactor):
             return False
         return self.i == other.i
 
+    def __hash__(self):
+        return hash(self.key)
+
     def is_deterministic(self):
         return True
 
     @property
     def i(self):
         return self._i
+
+    @property
+    def key(self) -> tuple:
+        return (type(self).__name__, self._charge.name, self._i.value)
@@ -1,21 +1,48 @@
 from enum import Enum
+from typing import Optional
 
 from .Texable import Texable
 
 
 class Symbol(Texable):
-    _value: str
+    __slots__ = ("_value", "_id", "_args")
+    _value: Optional[str]
+    _id: int
+    _args: tuple
+
+    # Symbols are interned: constructing one with the same class and arguments gives the
+    # same object, so equality is identity and the hash is a small integer id
+    _interned: dict[tuple, "Symbol"] = {}
+
+    def __new__(cls, *args):
+        key = (cls, *args)
+        self = Symbol._interned.get(key)
+        if self is None:
+            self = super().__new__(cls)
+            self._value = None
+            self._id = len(Symbol._interned)
+            self._args = args
+            Symbol._interned[key] = self
+        return self
 
     def __init__(self, value: str):
         self._value = value
 
+    def __reduce__(self):
+        # Unpickling goes through __new__, so it gives back the interned symbol
+        return (type(self), self._args)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def __tex__(self):
         return self.value
 
     def __eq__(self, other):
-        if not isinstance(other, Symbol):
-            return False
-        return self.value == other.value
+        return self is other
 
     def __lt__(self, other):
         if not isinstance(other, Symbol):
@@ -23,10 +50,15 @@ class Symbol(Texable):
         return self.value < other.value
 
     def __hash__(self):
-        return self._value.__hash__()
+        return self._id
 
     @property
-    def value(self):
+    def id(self) -> int:
+        return self._id
+
+    @property
+    def value(self) -> str:
+        assert self._value is not None
         return self._value
 
 
@@ -35,20 +67,19 @@ class Charge(Enum):
     Minus = Symbol("-")
     Neutral = Symbol(R"\pm")
 
+    # Members are singletons, also after unpickling
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
 
 class NumberedSymbol(Symbol):
+    __slots__ = ("_label", "_i")
     _label: str
     _i: int
 
     def __init__(self, label: str, i: int):
         self._label = label
         self._i = i
-        if i == 0:
-            super().__init__(f"{self._label}")
-        elif i < 10:
-            super().__init__(f"{self._label}_{i}")
-        else:
-            super().__init__(Rf"{self._label}_{{{i}}}")
 
     def __lt__(self, other):
         if isinstance(other, self.__class__):
@@ -59,33 +90,55 @@ class NumberedSymbol(Symbol):
     def __repr__(self):
         return self.__tex__()
 
+    @property
+    def value(self) -> str:
+        # Only formatted when needed
+        if self._value is None:
+            if self._i == 0:
+                self._value = f"{self._label}"
+            elif self._i < 10:
+                self._value = f"{self._label}_{self._i}"
+            else:
+                self._value = Rf"{self._label}_{{{self._i}}}"
+        return self._value
+
     @property
     def i(self):
         return self._i
 
 
 class a(NumberedSymbol):
+    __slots__ = ()
+
     def __init__(self, i: int):
         super().__init__("a", i)
 
 
 class b(NumberedSymbol):
+    __slots__ = ()
+
     def __init__(self, i: int):
         super().__init__("b", i)
 
 
 class d(Symbol):
+    __slots__ = ("_i", "_j")
     _i: int
     _j: int
 
     def __init__(self, i: int, j: int):
         self._i = i
         self._j = j
-        super().__init__(f"d_{{{i},{j}}}")
 
     def __repr__(self):
         return self.__tex__()
 
+    @property
+    def value(self) -> str:
+        if self._value is None:
+            self._value = f"d_{{{self._i},{self._j}}}"
+        return self._value
+
     @property
     def i(self):
         return self._i
@@ -96,10 +149,14 @@ class d(Symbol):
 
 
 class e(NumberedSymbol):
+    __slots__ = ()
+
     def __init__(self, i: int):
         super().__init__("e", i)
 
 
 class m(NumberedSymbol):
+    __slots__ = ()
+
     def __init__(self, i: int):
         super().__init__("m", i)
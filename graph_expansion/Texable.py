@@ -11,6 +11,8 @@ macros = R"""
 
 
 class Texable:
+    __slots__ = ()
+
     def __tex__(self) -> str:
         raise NotImplementedError("__tex__ not implemented")
 
@@ -1,6 +1,8 @@
+from .canonical import *
 from .Coefficient import *
 from .expansions import *
 from .Graph import *
+from .hashcons import *
 from .helpers import *
 from .MatrixFactor import *
 from .Symbol import *
@@ -0,0 +1,155 @@
+from collections import defaultdict
+from hashlib import blake2b
+
+from .Coefficient import ChargedCoefficient, Coefficient
+from .Graph import Graph, Trace
+from .MatrixFactor import E, MatrixFactor
+from .Symbol import Symbol, b
+
+# Canonical forms of graphs up to relabeling of the internal b indices.
+# External indices (a, e, m, ...) are left fixed.
+#
+# The b indices are colored by iterated refinement of their incidences (which
+# coefficients and traces they appear in and what they are connected to). If
+# the coloring does not separate every b, the remaining ties are broken by
+# individualizing each candidate in turn, and the lexicographically smallest
+# resulting key is kept. The result only depends on the isomorphism class.
+
+Labeling = dict[Symbol, Symbol]
+CanonicalKey = tuple
+
+
+def relabel(x: Graph, replacement_map: Labeling) -> Graph:
+    return Graph(
+        [relabel_coefficient(c, replacement_map) for c in x.coefficients],
+        [relabel_trace(t, replacement_map) for t in x.traces],
+    )
+
+
+def relabel_coefficient(c: Coefficient, replacement_map: Labeling) -> Coefficient:
+    i = replacement_map.get(c.i, c.i)
+    j = replacement_map.get(c.j, c.j)
+    if isinstance(c, ChargedCoefficient):
+        return type(c)(c.charges[0], c.charges[1], i, j)
+    else:
+        return type(c)(i, j)
+
+
+def relabel_trace(t: Trace, replacement_map: Labeling) -> Trace:
+    factors: list[MatrixFactor] = []
+    for f in t:
+        if isinstance(f, E) and f.i in replacement_map:
+            factors.append(E(replacement_map[f.i]))
+        else:
+            factors.append(f)
+    return Trace(factors)
+
+
+def canonical_labeling(x: Graph) -> Labeling:
+    return canonize(x)[1]
+
+
+def canonical_form(x: Graph) -> Graph:
+    return relabel(x, canonical_labeling(x))
+
+
+def canonical_key(x: Graph) -> CanonicalKey:
+    # Equal for two graphs if and only if they agree up to relabeling b indices
+    return canonize(x)[0]
+
+
+def canonical_hash(x: Graph) -> int:
+    # Stable across processes, unlike hash(canonical_key(x))
+    digest = blake2b(repr(canonical_key(x)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest)
+
+
+def canonize(x: Graph) -> tuple[CanonicalKey, Labeling]:
+    coefficient_incidences: dict[Symbol, list[tuple[Coefficient, int]]] = defaultdict(
+        list
+    )
+    trace_incidences: dict[Symbol, list[tuple[Trace, int]]] = defaultdict(list)
+    for c in x.coefficients:
+        for p, i in enumerate(c.indices):
+            if isinstance(i, b):
+                coefficient_incidences[i].append((c, p))
+    for t in x.traces:
+        for p, f in enumerate(t):
+            if isinstance(f, E) and isinstance(f.i, b):
+                trace_incidences[f.i].append((t, p))
+    vertices = list(
+        dict.fromkeys(list(coefficient_incidences) + list(trace_incidences))
+    )
+
+    def _label(i: Symbol, v: Symbol, colors: dict[Symbol, int]) -> tuple:
+        if i == v:
+            return (2, 0)
+        if i in colors:
+            return (1, colors[i])
+        return (0, i.value)
+
+    def _signature(v: Symbol, colors: dict[Symbol, int]) -> tuple:
+        entries: list[tuple] = []
+        for c, p in coefficient_incidences[v]:
+            charges = (
+                tuple(charge.name for charge in c.charges)
+                if isinstance(c, ChargedCoefficient)
+                else ()
+            )
+            other = c.indices[1 - p]
+            if c._symmetric and p == 1:
+                charges, p = charges[::-1], 0
+            entries.append(
+                ("c", type(c).__name__, charges, p, _label(other, v, colors))
+            )
+        for t, p in trace_incidences[v]:
+            entries.append(
+                (
+                    "t",
+                    tuple(
+                        ("E", _label(f.i, v, colors)) if isinstance(f, E) else f.key
+                        for f in t[p:] + t[:p]
+                    ),
+                )
+            )
+        entries.sort()
+        return (colors[v], tuple(entries))
+
+    def _refine(colors: dict[Symbol, int]) -> dict[Symbol, int]:
+        n_colors = len(set(colors.values()))
+        while True:
+            signatures = {v: _signature(v, colors) for v in vertices}
+            ranks = {s: r for r, s in enumerate(sorted(set(signatures.values())))}
+            colors = {v: ranks[signatures[v]] for v in vertices}
+            if len(ranks) == n_colors:
+                return colors
+            n_colors = len(ranks)
+
+    def _encode(labeling: Labeling) -> CanonicalKey:
+        return (
+            tuple(sorted(relabel_coefficient(c, labeling).key for c in x.coefficients)),
+            tuple(sorted(relabel_trace(t, labeling).key for t in x.traces)),
+        )
+
+    def _search(colors: dict[Symbol, int]) -> tuple[CanonicalKey, Labeling]:
+        colors = _refine(colors)
+        cells: dict[int, list[Symbol]] = defaultdict(list)
+        for v in vertices:
+            cells[colors[v]].append(v)
+
+        non_singletons = [color for color, cell in cells.items() if len(cell) > 1]
+        if not non_singletons:
+            labeling: Labeling = {v: b(colors[v] + 1) for v in vertices}
+            return _encode(labeling), labeling
+
+        best: tuple[CanonicalKey, Labeling] | None = None
+        for v in cells[min(non_singletons)]:
+            individualized = {u: 2 * color + 1 for u, color in colors.items()}
+            individualized[v] -= 1
+            candidate = _search(individualized)
+            if best is None or candidate[0] < best[0]:
+                best = candidate
+        assert best is not None
+        return best
+
+    return _search({v: 0 for v in vertices})
@@ -1,7 +1,17 @@
-from typing import Callable, Optional
-
-from .Coefficient import S, STheta, Theta, calM
-from .Graph import Graph, Trace, last_G_index
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from .Coefficient import Coefficient, S, STheta, Theta
+from .Graph import (
+    Graph,
+    Trace,
+    best_G_index,
+    coefficient_sort_key,
+    deterministic_sort_key,
+    g_loop_sort_key,
+    last_G_index,
+    merge_sorted,
+    to_calM,
+)
 from .helpers import k
 from .MatrixFactor import E, G, M, MatrixFactor, wtG
 from .Symbol import b
@@ -15,7 +25,39 @@ def expand_G_loop(
     G_index: int = 0,
     solve: bool = True,
     with_cross_derivative_terms=True,
+    with_deterministic_terms=True,
+    max_order: Optional[int] = None,
 ) -> list[Graph]:
+    return list(
+        iter_expand_G_loop(
+            x,
+            trace_predicate=trace_predicate,
+            trace_index=trace_index,
+            G_predicate=G_predicate,
+            G_index=G_index,
+            solve=solve,
+            with_cross_derivative_terms=with_cross_derivative_terms,
+            with_deterministic_terms=with_deterministic_terms,
+            max_order=max_order,
+        )
+    )
+
+
+def iter_expand_G_loop(
+    x: Graph,
+    trace_predicate: Optional[Callable[[Trace], bool]] = None,
+    trace_index: Optional[int] = 0,
+    G_predicate: Optional[Callable[[G], bool]] = None,
+    G_index: int = 0,
+    solve: bool = True,
+    with_cross_derivative_terms=True,
+    with_deterministic_terms=True,
+    max_order: Optional[int] = None,
+) -> Iterator[Graph]:
+    # Same children in the same order as expand_G_loop, but each one is only built
+    # when it is consumed. With max_order, children whose order is larger are skipped
+    # without being built, and without with_deterministic_terms, so are the
+    # deterministic children
     if trace_predicate:
         for j, t in enumerate(x.g_loops):
             if trace_predicate(t):
@@ -40,8 +82,7 @@ def expand_G_loop(
     assert G_index is not None
 
     # Rewrite the loop so that the target G is the first matrix in the trace
-    for _ in range(G_index):
-        target_trace.cycle()
+    target_trace = target_trace.cycle(G_index)
 
     for j, f in enumerate(target_trace[1:]):
         if isinstance(f, G):
@@ -69,6 +110,10 @@ def expand_G_loop(
     b_3 = b(current_max_b_index + 3)
     b_4 = b(current_max_b_index + 4)
 
+    # New parts that are the same in every child, so that the children share them
+    S_12 = S(b_1, b_2)
+    wtG_trace = Trace(wtG(sigma_1), E(b_2))
+
     # x = coefficients * target_trace * f
     coefficients = x.coefficients
     f_G = (
@@ -77,89 +122,123 @@ def expand_G_loop(
         + x.g_loops[:trace_index]
         + x.g_loops[trace_index + 1 :]
     )
+    f_parts = _Parts(
+        coefficients,
+        f_G,
+        x.deterministics,
+        x.light_weights,
+        x.g_loops[:trace_index] + x.g_loops[trace_index + 1 :],
+    )
+
+    # Each child is f_G times the traces and coefficients that replace target_trace, so
+    # its order is the order of f_G plus theirs
+    if not can_predict_order(x):
+        max_order = None
+    f_order = x.order - trace_order(len(target_trace))
+    f_is_deterministic = not x.light_weights and len(x.g_loops) == 1
 
     def _G(
         A: MatrixFactor | list[MatrixFactor],
         with_self_consistent_term=False,
         with_cross_derivative_terms=True,
-    ) -> list[Graph]:
-        out: list[Graph] = []
+        A_order=0,
+        prefix: _Parts = NO_PARTS,
+    ) -> Iterator[Graph]:
+        l_A = 1 if isinstance(A, MatrixFactor) else len(A)
+
+        def _keep(child_order: int) -> bool:
+            return max_order is None or f_order + A_order + child_order <= max_order
 
         # From G = \G + M, get the M term
         if k(target_trace) == 2:
-            out.append(
-                Graph(
-                    coefficients,
-                    Trace(
-                        M(sigma_1),
-                        B_1,
-                        target_trace[next_G_index:last_G_i],
-                        M(sigma_n),
-                        A,
-                    ),
-                    f_G,
+            # This is the only term that can be deterministic
+            if (with_deterministic_terms or not f_is_deterministic) and _keep(
+                trace_order(last_G_i + 1 + l_A)
+            ):
+                yield _child(
+                    prefix,
+                    [],
+                    [
+                        Trace(
+                            M(sigma_1),
+                            B_1,
+                            target_trace[next_G_index:last_G_i],
+                            M(sigma_n),
+                            A,
+                        ),
+                    ],
+                    f_parts,
                 )
-            )
-            out.append(
-                Graph(
-                    coefficients,
+            if _keep(trace_order(last_G_i + 1 + l_A, light_weight=True)):
+                yield _child(
+                    prefix,
+                    [],
+                    [
+                        Trace(
+                            M(sigma_1),
+                            B_1,
+                            target_trace[next_G_index:last_G_i],
+                            wtG(sigma_n),
+                            A,
+                        ),
+                    ],
+                    f_parts,
+                )
+        elif _keep(trace_order(last_G_i + 1 + l_A)):
+            yield _child(
+                prefix,
+                [],
+                [
                     Trace(
                         M(sigma_1),
                         B_1,
                         target_trace[next_G_index:last_G_i],
-                        wtG(sigma_n),
+                        G(sigma_n),
                         A,
                     ),
-                    f_G,
-                )
+                ],
+                f_parts,
             )
-        else:
-            out.append(
-                Graph(
-                    coefficients,
+
+        # Light-weight term 1
+        if _keep(
+            trace_order(last_G_i + 3 + l_A)
+            + S_ORDER
+            + trace_order(2, light_weight=True)
+        ):
+            yield _child(
+                prefix,
+                [S_12],
+                [
                     Trace(
                         M(sigma_1),
-                        B_1,
-                        target_trace[next_G_index:last_G_i],
+                        E(b_1),
+                        target_trace[:last_G_i],
                         G(sigma_n),
                         A,
                     ),
-                    f_G,
-                )
-            )
-
-        # Light-weight term 1
-        out.append(
-            Graph(
-                coefficients,
-                Trace(
-                    M(sigma_1),
-                    E(b_1),
-                    target_trace[:last_G_i],
-                    G(sigma_n),
-                    A,
-                ),
-                S(b_1, b_2),
-                Trace(wtG(sigma_1), E(b_2)),
-                f_G,
+                    wtG_trace,
+                ],
+                f_parts,
             )
-        )
 
         # Self-consistent term
-        if with_self_consistent_term:
-            out.append(
-                Graph(
-                    coefficients,
+        if with_self_consistent_term and _keep(
+            trace_order(3 + l_A) + S_ORDER + trace_order(last_G_i + 2)
+        ):
+            yield _child(
+                prefix,
+                [S_12],
+                [
                     Trace(
                         M(sigma_1),
                         E(b_1),
                         M(sigma_n),
                         A,
                     ),
-                    S(b_1, b_2),
                     Trace(target_trace[:last_G_i], G(sigma_n), E(b_2)),
-                    f_G,
-                )
+                ],
+                f_parts,
             )
 
         # Self-derivative terms
@@ -168,9 +247,14 @@ def expand_G_loop(
                 continue
             j = i + 1
             sigma_j = f.charge
-            out.append(
-                Graph(
-                    coefficients,
+            if not _keep(
+                trace_order(last_G_i - j + 3 + l_A) + S_ORDER + trace_order(j + 2)
+            ):
+                continue
+            yield _child(
+                prefix,
+                [S_12],
+                [
                     Trace(
                         M(sigma_1),
                         E(b_1),
@@ -178,41 +262,60 @@ def expand_G_loop(
                         G(sigma_n),
                         A,
                     ),
-                    S(b_1, b_2),
                     Trace(target_trace[:j], G(sigma_j), E(b_2)),
-                    f_G,
-                )
+                ],
+                f_parts,
             )
 
         # Light-weight term 2
-        out.append(
-            Graph(
-                coefficients,
-                Trace(
-                    M(sigma_1),
-                    E(b_1),
-                    wtG(sigma_n),
-                    A,
-                ),
-                S(b_1, b_2),
-                Trace(target_trace[:last_G_i], G(sigma_n), E(b_2)),
-                f_G,
+        if _keep(
+            trace_order(3 + l_A, light_weight=True)
+            + S_ORDER
+            + trace_order(last_G_i + 2)
+        ):
+            yield _child(
+                prefix,
+                [S_12],
+                [
+                    Trace(
+                        M(sigma_1),
+                        E(b_1),
+                        wtG(sigma_n),
+                        A,
+                    ),
+                    Trace(target_trace[:last_G_i], G(sigma_n), E(b_2)),
+                ],
+                f_parts,
             )
-        )
 
         if with_cross_derivative_terms:
             other_traces = (
                 x.g_loops[:trace_index] + x.g_loops[trace_index + 1 :] + x.light_weights
             )
             for i, other_trace in enumerate(other_traces):
+                # The other trace is merged into the new G-loop
+                cross_order = (
+                    trace_order(len(other_trace) + last_G_i + 5 + l_A)
+                    + S_ORDER
+                    - trace_order(len(other_trace), light_weight=other_trace.n_wtG > 0)
+                )
+                if not _keep(cross_order):
+                    continue
                 remaining_traces = other_traces[:i] + other_traces[i + 1 :]
+                remaining = _Parts(
+                    coefficients,
+                    x.deterministics + remaining_traces,
+                    x.deterministics,
+                    tuple([t for t in remaining_traces if t.n_wtG > 0]),
+                    tuple([t for t in remaining_traces if t.n_wtG == 0]),
+                )
                 for j, f in enumerate(other_trace):
                     if not isinstance(f, G | wtG):
                         continue
-                    out.append(
-                        Graph(
-                            coefficients,
-                            S(b_1, b_2),
+                    yield _child(
+                        prefix,
+                        [S_12],
+                        [
                             Trace(
                                 M(sigma_1),
                                 E(b_1),
@@ -225,35 +328,39 @@ def expand_G_loop(
                                 G(sigma_n),
                                 A,
                             ),
-                            x.deterministics,
-                            remaining_traces,
-                        )
+                        ],
+                        remaining,
                     )
 
-        return out
-
     if not solve:
-        return _G(
+        yield from _G(
             B_n,
             with_self_consistent_term=True,
             with_cross_derivative_terms=with_cross_derivative_terms,
         )
+        return
 
     # Special case where B_n = E_z
     E_z = B_n[0]
     if len(B_n) == 1 and isinstance(E_z, E):
         z = E_z.i
-        return [
-            Theta(sigma_n, sigma_1, z, b_3) * g
-            for g in _G(E(b_3), with_cross_derivative_terms=with_cross_derivative_terms)
-        ]
+        yield from _G(
+            E(b_3),
+            with_cross_derivative_terms=with_cross_derivative_terms,
+            A_order=THETA_ORDER,
+            prefix=_Parts((Theta(sigma_n, sigma_1, z, b_3),), (), (), (), ()),
+        )
     else:
-        return _G(B_n, with_cross_derivative_terms=with_cross_derivative_terms) + [
-            Trace(M(sigma_n), B_n, M(sigma_1), E(b_3))
-            * STheta(sigma_n, sigma_1, b_3, b_4)
-            * g
-            for g in _G(E(b_4), with_cross_derivative_terms=with_cross_derivative_terms)
-        ]
+        yield from _G(B_n, with_cross_derivative_terms=with_cross_derivative_terms)
+        solved = Trace(M(sigma_n), B_n, M(sigma_1), E(b_3)) * STheta(
+            sigma_n, sigma_1, b_3, b_4
+        )
+        yield from _G(
+            E(b_4),
+            with_cross_derivative_terms=with_cross_derivative_terms,
+            A_order=trace_order(len(B_n) + 3) + STHETA_ORDER,
+            prefix=_parts(solved),
+        )
 
 
 def expand_light_weight(
@@ -261,7 +368,29 @@ def expand_light_weight(
     trace_predicate: Optional[Callable[[Trace], bool]] = None,
     trace_index: Optional[int] = None,
     solve: bool = True,
+    max_order: Optional[int] = None,
 ) -> list[Graph]:
+    return list(
+        iter_expand_light_weight(
+            x,
+            trace_predicate=trace_predicate,
+            trace_index=trace_index,
+            solve=solve,
+            max_order=max_order,
+        )
+    )
+
+
+def iter_expand_light_weight(
+    x: Graph,
+    trace_predicate: Optional[Callable[[Trace], bool]] = None,
+    trace_index: Optional[int] = None,
+    solve: bool = True,
+    max_order: Optional[int] = None,
+) -> Iterator[Graph]:
+    # Same children in the same order as expand_light_weight, but each one is only
+    # built when it is consumed. With max_order, children whose order is larger are
+    # skipped without being built
     if trace_predicate:
         for j, t in enumerate(x.light_weights):
             if trace_predicate(t):
@@ -277,7 +406,7 @@ def expand_light_weight(
 
     # Rewrite the loop so that the target G is the first matrix in the trace
     while not isinstance(target_trace[0], wtG):
-        target_trace.cycle()
+        target_trace = target_trace.cycle()
 
     G_1 = target_trace[0]
     B_1: list[MatrixFactor] = target_trace[1:]
@@ -292,6 +421,10 @@ def expand_light_weight(
     b_3 = b(current_max_b_index + 3)
     b_4 = b(current_max_b_index + 4)
 
+    # New parts that are the same in every child, so that the children share them
+    S_12 = S(b_1, b_2)
+    wtG_trace = Trace(wtG(sigma), E(b_2))
+
     # x = coefficients * target_trace * f
     coefficients = x.coefficients
     f_G = (
@@ -300,44 +433,70 @@ def expand_light_weight(
         + x.light_weights[trace_index + 1 :]
         + x.g_loops
     )
+    f_parts = _Parts(
+        coefficients,
+        f_G,
+        x.deterministics,
+        x.light_weights[:trace_index] + x.light_weights[trace_index + 1 :],
+        x.g_loops,
+    )
+
+    # Each child is f_G times the traces and coefficients that replace target_trace, so
+    # its order is the order of f_G plus theirs
+    if not can_predict_order(x):
+        max_order = None
+    f_order = x.order - trace_order(len(target_trace), light_weight=True)
 
     def _G(
-        A: MatrixFactor | list[MatrixFactor], with_self_consistent_term=False
-    ) -> list[Graph]:
-        out: list[Graph] = []
+        A: MatrixFactor | list[MatrixFactor],
+        with_self_consistent_term=False,
+        A_order=0,
+        prefix: _Parts = NO_PARTS,
+    ) -> Iterator[Graph]:
+        l_A = 1 if isinstance(A, MatrixFactor) else len(A)
+
+        def _keep(child_order: int) -> bool:
+            return max_order is None or f_order + A_order + child_order <= max_order
 
         # Self-consistent term
-        if with_self_consistent_term:
-            out.append(
-                Graph(
-                    coefficients,
+        if with_self_consistent_term and _keep(
+            trace_order(3 + l_A) + S_ORDER + trace_order(2, light_weight=True)
+        ):
+            yield _child(
+                prefix,
+                [S_12],
+                [
                     Trace(
                         M(sigma),
                         E(b_1),
                         M(sigma),
                         A,
                     ),
-                    S(b_1, b_2),
-                    Trace(wtG(sigma), E(b_2)),
-                    f_G,
-                )
+                    wtG_trace,
+                ],
+                f_parts,
             )
 
         # Light-weight
-        out.append(
-            Graph(
-                coefficients,
-                Trace(
-                    M(sigma),
-                    E(b_1),
-                    wtG(sigma),
-                    A,
-                ),
-                S(b_1, b_2),
-                Trace(wtG(sigma), E(b_2)),
-                f_G,
+        if _keep(
+            trace_order(3 + l_A, light_weight=True)
+            + S_ORDER
+            + trace_order(2, light_weight=True)
+        ):
+            yield _child(
+                prefix,
+                [S_12],
+                [
+                    Trace(
+                        M(sigma),
+                        E(b_1),
+                        wtG(sigma),
+                        A,
+                    ),
+                    wtG_trace,
+                ],
+                f_parts,
             )
-        )
 
         other_traces = (
             x.light_weights[:trace_index]
@@ -345,14 +504,29 @@ def expand_light_weight(
             + x.g_loops
         )
         for i, other_trace in enumerate(other_traces):
+            # The other trace is merged into the new G-loop
+            cross_order = (
+                trace_order(len(other_trace) + 5 + l_A)
+                + S_ORDER
+                - trace_order(len(other_trace), light_weight=other_trace.n_wtG > 0)
+            )
+            if not _keep(cross_order):
+                continue
             remaining_traces = other_traces[:i] + other_traces[i + 1 :]
+            remaining = _Parts(
+                coefficients,
+                x.deterministics + remaining_traces,
+                x.deterministics,
+                tuple([t for t in remaining_traces if t.n_wtG > 0]),
+                tuple([t for t in remaining_traces if t.n_wtG == 0]),
+            )
             for j, f in enumerate(other_trace):
                 if not isinstance(f, G | wtG):
                     continue
-                out.append(
-                    Graph(
-                        coefficients,
-                        S(b_1, b_2),
+                yield _child(
+                    prefix,
+                    [S_12],
+                    [
                         Trace(
                             M(sigma),
                             E(b_1),
@@ -364,37 +538,135 @@ def expand_light_weight(
                             G(sigma),
                             A,
                         ),
-                        x.deterministics,
-                        remaining_traces,
-                    )
+                    ],
+                    remaining,
                 )
 
-        return out
-
     if not solve:
-        return _G(B_1, with_self_consistent_term=True)
+        yield from _G(B_1, with_self_consistent_term=True)
+        return
 
     # Special case where B_1 = E_z
     E_z = B_1[0]
     if len(B_1) == 1 and isinstance(E_z, E):
         z = E_z.i
-        return [Theta(sigma, sigma, z, b_3) * g for g in _G(E(b_3))]
+        yield from _G(
+            E(b_3),
+            A_order=THETA_ORDER,
+            prefix=_Parts((Theta(sigma, sigma, z, b_3),), (), (), (), ()),
+        )
     else:
-        return _G(B_1) + [
-            Trace(M(sigma), B_1, M(sigma), E(b_3)) * STheta(sigma, sigma, b_3, b_4) * g
-            for g in _G(E(b_4))
-        ]
+        yield from _G(B_1)
+        solved = Trace(M(sigma), B_1, M(sigma), E(b_3)) * STheta(sigma, sigma, b_3, b_4)
+        yield from _G(
+            E(b_4),
+            A_order=trace_order(len(B_1) + 3) + STHETA_ORDER,
+            prefix=_parts(solved),
+        )
 
 
 def largest_b_index(x: Graph) -> int:
-    all_b_indices: list[b] = []
-    for c in x.coefficients:
-        if isinstance(c, S | Theta | STheta | calM):
-            for i in c.indices:
-                if isinstance(i, b):
-                    all_b_indices.append(i)
-    for t in x.traces:
-        for f in t:
-            if isinstance(f, E) and isinstance(f.i, b):
-                all_b_indices.append(f.i)
-    return max([b.i for b in all_b_indices], default=0)
+    return x.max_b_index
+
+
+def b_indices(x: Graph) -> set[b]:
+    return set(x.b_indices)
+
+
+# Child orders
+
+# Contributions to Graph.order of the coefficients the rules introduce, each of which
+# carries its new b indices: S(b_1, b_2) and STheta(..., b_3, b_4) add two, Theta(..., z,
+# b_3) adds one
+S_ORDER = -1
+THETA_ORDER = 0
+STHETA_ORDER = -1
+
+
+def trace_order(length: int, light_weight=False) -> int:
+    # Contribution of a trace of the given length to Graph.order
+    return length // 2 if light_weight else length // 2 - 1
+
+
+def can_predict_order(x: Graph) -> bool:
+    # The child orders above assume that every b index of x is on a coefficient, so
+    # that the b indices counted by Graph.order are exactly the b indices of the graph.
+    # The rules preserve this, and it holds for graphs with no b indices
+    coefficient_indices = {i for c in x.coefficients for i in c.indices}
+    return all(i in coefficient_indices for i in x.b_indices)
+
+
+# Building children
+
+# Every child is Graph(prefix, f.coefficients, new coefficients, new traces, f.traces),
+# where prefix is what the special cases of the rules multiply it by and f is the part
+# of x that the rule does not touch. The parts of prefix and f are already in the form
+# Graph(...) stores them, so only the new traces are classified and the sorted
+# categories are merged instead of sorted again
+
+
+class _Parts(NamedTuple):
+    coefficients: tuple[Coefficient, ...]
+    traces: tuple[Trace, ...]
+    deterministics: tuple[Trace, ...]
+    light_weights: tuple[Trace, ...]
+    g_loops: tuple[Trace, ...]
+
+
+NO_PARTS = _Parts((), (), (), (), ())
+
+
+def _parts(x: Graph) -> _Parts:
+    return _Parts(
+        x.coefficients, x.traces, x.deterministics, x.light_weights, x.g_loops
+    )
+
+
+def _child(
+    prefix: _Parts,
+    new_coefficients: list[Coefficient],
+    new_traces: list[Trace],
+    f: _Parts,
+) -> Graph:
+    coefficients = list(new_coefficients)
+    traces: list[Trace] = []
+    deterministics: list[Trace] = []
+    light_weights: list[Trace] = []
+    g_loops: list[Trace] = []
+    # Same classification as Graph(...)
+    for t in new_traces:
+        if t.n_wtG == 0 and t.n_G == 0:
+            if len(t) == 4:
+                coefficients.append(to_calM(t))
+                continue
+            deterministics.append(t)
+        elif t.n_wtG == 0 and t.n_G > 1:
+            g_loops.append(t.cycle(best_G_index(t)))
+        elif t.n_wtG == 1 and t.n_G == 0:
+            light_weights.append(t)
+        else:
+            raise TypeError("Trace is not deterministic, light-weight, or G-loop")
+        traces.append(t)
+    coefficients.sort(key=coefficient_sort_key)
+    deterministics.sort(key=deterministic_sort_key)
+    g_loops.sort(key=g_loop_sort_key)
+
+    return Graph.from_parts(
+        merge_sorted(
+            prefix.coefficients,
+            merge_sorted(f.coefficients, coefficients, coefficient_sort_key),
+            coefficient_sort_key,
+        ),
+        prefix.traces + tuple(traces) + f.traces,
+        merge_sorted(
+            prefix.deterministics,
+            merge_sorted(deterministics, f.deterministics, deterministic_sort_key),
+            deterministic_sort_key,
+        ),
+        prefix.light_weights + tuple(light_weights) + f.light_weights,
+        merge_sorted(
+            prefix.g_loops,
+            merge_sorted(g_loops, f.g_loops, g_loop_sort_key),
+            g_loop_sort_key,
+        ),
+    )
@@ -0,0 +1,131 @@
+import sys
+from typing import Iterable, NamedTuple, TypeVar
+
+from .Coefficient import ChargedCoefficient, Coefficient
+from .Graph import Graph, Trace
+
+# Hash-consing of the parts of graphs, so that equal coefficients, traces and tuples of
+# them are a single object in memory. Values are compared exactly (the order of the
+# factors of a trace and of the indices of a coefficient), not up to rotation or
+# transposition, so replacing an object by its representative never changes a graph
+
+Part = TypeVar("Part", Coefficient, Trace)
+
+
+def hash_cons_key(x: Coefficient | Trace) -> tuple:
+    if isinstance(x, Trace):
+        return (Trace, tuple(f.key for f in x))
+    elif isinstance(x, ChargedCoefficient):
+        return (type(x), x.charges, x.indices)
+    else:
+        return (type(x), x.indices)
+
+
+class HashConsTable:
+    __slots__ = ("_objects", "_tuples", "_hits", "_misses")
+    _objects: dict[tuple, Coefficient | Trace]
+    _tuples: dict[tuple[int, ...], tuple]
+    _hits: int
+    _misses: int
+
+    def __init__(self):
+        self._objects = {}
+        self._tuples = {}
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._objects)
+
+    def intern(self, x: Part) -> Part:
+        key = hash_cons_key(x)
+        representative = self._objects.get(key)
+        if representative is None:
+            self._objects[key] = x
+            self._misses += 1
+            return x
+        self._hits += 1
+        return representative  # type: ignore
+
+    def intern_tuple(self, xs: Iterable[Part]) -> tuple[Part, ...]:
+        # The representatives are kept alive by the table, so their ids are stable
+        out = tuple(self.intern(x) for x in xs)
+        return self._tuples.setdefault(tuple(map(id, out)), out)
+
+    def share(self, x: Graph) -> Graph:
+        # The same graph, built from the representatives of its parts
+        out = Graph.__new__(Graph)
+        for name in Graph.__slots__:
+            value = getattr(x, name)
+            if name in (
+                "_coefficients",
+                "_traces",
+                "_deterministics",
+                "_light_weights",
+                "_g_loops",
+            ):
+                value = self.intern_tuple(value)
+            setattr(out, name, value)
+        return out
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+
+class MemoryReport(NamedTuple):
+    graphs: int
+    # Coefficients and traces held by the graphs
+    references: int
+    objects: int
+    values: int
+    # Bytes used by the distinct objects, if every reference had its own object, and if
+    # there was one object per value
+    bytes: int
+    unshared_bytes: int
+    hash_consed_bytes: int
+
+
+def memory_report(graphs: Iterable[Graph]) -> MemoryReport:
+    # Sizes are shallow sizes of the coefficients and traces and of the tuples and sets
+    # they hold, counting each container once
+    n_graphs = 0
+    n_references = 0
+    objects: dict[int, Coefficient | Trace] = {}
+    values: dict[tuple, Coefficient | Trace] = {}
+    unshared_bytes = 0
+    containers: dict[int, int] = {}
+    for x in graphs:
+        n_graphs += 1
+        for part in [*x.coefficients, *x.traces, *x.g_loops]:
+            n_references += 1
+            unshared_bytes += sum(_sizes(part).values())
+            if id(part) not in objects:
+                objects[id(part)] = part
+                containers.update(_sizes(part))
+                values.setdefault(hash_cons_key(part), part)
+
+    return MemoryReport(
+        n_graphs,
+        n_references,
+        len(objects),
+        len(values),
+        sum(containers.values()),
+        unshared_bytes,
+        sum([sum(_sizes(part).values()) for part in values.values()]),
+    )
+
+
+def _sizes(x: Coefficient | Trace) -> dict[int, int]:
+    # Sizes of x and of the containers it holds, by id
+    if isinstance(x, Trace):
+        parts = [x, x._factors, x._canonical, x._b_indices]
+    elif isinstance(x, ChargedCoefficient):
+        parts = [x, x._indices, x._charges]
+    else:
+        parts = [x, x._indices]
+    return {id(part): sys.getsizeof(part) for part in parts}
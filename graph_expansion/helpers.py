@@ -1,40 +1,37 @@
-from copy import deepcopy
 from typing import TypeVar
 
-from .Coefficient import Coefficient, S, Theta, calM
+from .Coefficient import Coefficient, Theta
 from .Graph import Graph, Size, Trace
-from .MatrixFactor import E, G, M, MatrixFactor
+from .MatrixFactor import MatrixFactor
 
 T = TypeVar("T", MatrixFactor, list[MatrixFactor])
 
 
 def adjoint(x: T) -> T:
     if isinstance(x, list):
-        return deepcopy([adjoint(x0) for x0 in x])
+        return [adjoint(x0) for x0 in x]
     else:
-        out = deepcopy(x)
-        out.__adjoint__()
-        return out
+        return x.__adjoint__()
 
 
 def p(x: Graph) -> int:
-    return len([c for c in x.coefficients if isinstance(c, S)])
+    return x.p
 
 
 def q(x: Graph) -> int:
-    return len(x.light_weights)
+    return x.q
 
 
 def r(x: Graph) -> int:
-    return len(x.g_loops)
+    return x.r
 
 
 def k(t: Trace) -> int:
-    return len([f for f in t if isinstance(f, G)])
+    return t.n_G
 
 
 def n(x: Graph) -> int:
-    return sum([k(t) for t in x.g_loops])
+    return x.n
 
 
 def size(x: Graph) -> Size:
@@ -0,0 +1,57 @@
+import time
+
+from graph_analysis import *
+from graph_expansion import *
+
+
+def test_shared_cache_matches_plain_traversal():
+    # The two graphs have the same canonical key, but their expansions start from
+    # different G's
+    x0 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+    x1 = Graph(Trace(G(), E(a(3)), G(), E(a(1)), G(), E(a(2))))
+    cache = ExpansionCache()
+    for x in [x0, x1]:
+        assert compute_leading_terms(x, 4, cache=cache) == compute_leading_terms(x, 4)
+
+
+def test_deeper_cache_matches_plain_traversal():
+    x0 = Graph(Trace(G(), E(a(1)), adjoint(G()), E(a(2)), G(), E(a(3))))
+    cache = ExpansionCache()
+    plain = compute_leading_terms(x0, 4)
+    for _ in range(2):
+        assert compute_cached_leading_terms(x0, 4, cache, cache_depth=3) == plain
+    assert cache.info().hits > 0
+
+
+def test_cache_size_is_bounded_by_leading_terms():
+    x0 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+    n_terms = len(compute_leading_terms(x0, 4))
+    cache = ExpansionCache(maxsize=n_terms - 1)
+    assert compute_leading_terms(x0, 4, cache=cache) == compute_leading_terms(x0, 4)
+    info = cache.info()
+    assert info.currsize <= n_terms - 1
+    # The entry of x0 holds every leading term, so it is not stored
+    assert compute_leading_terms(x0, 4, cache=cache) == compute_leading_terms(x0, 4)
+    assert cache.info().hits == info.hits
+
+
+def test_drift_terms_are_not_slower_with_cache():
+    x0 = Graph(Trace(G(), E(a(1)), adjoint(G()), E(a(2))))
+    terms = drift_terms(x0)
+
+    def best_time(cache_factory):
+        times = []
+        for _ in range(3):
+            cache = cache_factory()
+            start = time.perf_counter()
+            for x in terms:
+                if cache is None:
+                    compute_leading_terms(x, 3)
+                else:
+                    compute_leading_terms(x, 3, cache=cache)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    plain = best_time(lambda: None)
+    cached = best_time(ExpansionCache)
+    assert cached < 1.25 * plain
@@ -0,0 +1,29 @@
+from graph_analysis import *
+from graph_expansion import *
+
+x0 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+
+
+def transpose_symmetric(x: Graph) -> Graph:
+    return Graph(
+        [c.transpose() if c._symmetric else c for c in x.coefficients], x.traces
+    )
+
+
+def test_transposed_symmetric_coefficient_keeps_key():
+    x = Graph(
+        STheta(Charge.Plus, Charge.Minus, b(1), b(2)),
+        Theta(Charge.Plus, Charge.Plus, a(1), b(1)),
+        S(b(2), b(3)),
+        Trace(E(b(3)), M(Charge.Plus)),
+    )
+    y = transpose_symmetric(x)
+    assert x == y
+    assert canonical_key(x) == canonical_key(y)
+
+
+def test_transposed_leading_terms_keep_keys():
+    for x in matrix_multiplication(compute_leading_terms(x0, 4)):
+        y = transpose_symmetric(x)
+        assert x == y
+        assert canonical_key(x) == canonical_key(y)
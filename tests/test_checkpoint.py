@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from graph_analysis import *
+from graph_expansion import *
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+X0 = "Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))"
+
+
+def run(code: str, seed: int) -> str:
+    # Runs code in a fresh process, with its own str hashes and Symbol ids
+    return subprocess.run(
+        [sys.executable, "-c", f"from graph_analysis import *\n{code}"],
+        cwd=ROOT,
+        env=os.environ | {"PYTHONHASHSEED": str(seed)},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def test_resume_in_another_process(tmp_path):
+    path = str(tmp_path / "checkpoint.pkl")
+    # Stops early, after saving a checkpoint with part of the stack left
+    run(
+        f"compute_leading_terms({X0}, 3, max_terms=10, checkpoint={path!r}, "
+        "checkpoint_every=5)",
+        seed=1,
+    )
+    resumed = run(
+        f"b(1000)\n"
+        f"terms = compute_leading_terms({X0}, 3, resume={path!r})\n"
+        "print('\\n'.join([to_python(x) for x in terms]))",
+        seed=2,
+    )
+    x0 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+    expected = "\n".join([to_python(x) for x in compute_leading_terms(x0, 3)])
+    assert resumed.strip() == expected.strip()
+
+
+def test_resume_from_missing_file(tmp_path):
+    x0 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+    with pytest.raises(FileNotFoundError):
+        compute_leading_terms(x0, 3, resume=str(tmp_path / "missing.pkl"))
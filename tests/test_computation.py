@@ -0,0 +1,67 @@
+from collections import Counter
+
+import pytest
+
+from graph_analysis import *
+from graph_expansion import *
+
+x0 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(workers=2, cache=ExpansionCache()),
+        dict(collapse_isomorphic=True, checkpoint="checkpoint.pkl"),
+        dict(workers=2, resume="checkpoint.pkl"),
+        dict(cache=ExpansionCache(), count_error_terms=True),
+        dict(cache=ExpansionCache(), max_terms=10),
+    ],
+)
+def test_unsupported_arguments_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        compute_leading_terms(x0, 3, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "x0",
+    [
+        Graph(Trace(G(), E(a(1)), G(), E(a(2)))),
+        Graph(Trace(G(), E(a(1)), adjoint(G()), E(a(2)))),
+        Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3)))),
+    ],
+)
+@pytest.mark.parametrize("o", [3, 4])
+def test_pruning_keeps_leading_terms(x0, o):
+    pruned = compute_leading_terms(x0, o)
+    unpruned = compute_leading_terms(x0, o, prune=False)
+    assert [to_python(x) for x in pruned] == [to_python(x) for x in unpruned]
+
+
+@pytest.mark.parametrize("max_terms", [None, 1, 100])
+def test_parallel_matches_serial(max_terms):
+    serial = compute_leading_terms(x0, 4, max_terms=max_terms)
+    parallel = compute_parallel_leading_terms(
+        x0, 4, 2, max_terms=max_terms, split_after=10
+    )
+    assert [to_python(x) for x in parallel] == [to_python(x) for x in serial]
+
+
+@pytest.mark.parametrize(
+    "x0",
+    [
+        Graph(Trace(G(), E(a(1)), G(), E(a(2)))),
+        Graph(Trace(G(), E(a(1)), adjoint(G()), E(a(2)))),
+        Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3)))),
+    ],
+)
+@pytest.mark.parametrize("o", [3, 4])
+@pytest.mark.parametrize(
+    "traversal", [compute_collapsed_leading_terms, compute_breadth_first_leading_terms]
+)
+def test_collapsed_traversals_match_leading_terms(x0, o, traversal):
+    expected = Counter([canonical_key(x) for x in compute_leading_terms(x0, o)])
+    collapsed: Counter = Counter()
+    for x, multiplicity in traversal(x0, o):
+        collapsed[canonical_key(x)] += multiplicity
+    assert collapsed == expected
@@ -0,0 +1,29 @@
+from collections import Counter
+
+import pytest
+
+from graph_analysis import *
+from graph_expansion import *
+
+
+@pytest.mark.parametrize(
+    "x0",
+    [
+        Graph(Trace(G(), E(a(1)), G(), E(a(2)))),
+        Graph(Trace(G(), E(a(1)), adjoint(G()), E(a(2)))),
+        Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3)))),
+        Graph(Trace(G(), E(a(1)), G(), E(a(2))), Trace(G(), E(a(3)), G(), E(a(4)))),
+        Graph(Trace(wtG(), E(a(1)), M(), E(a(2))), Trace(G(), E(a(3)), G(), E(a(4)))),
+    ],
+)
+@pytest.mark.parametrize("o", [3, 4])
+@pytest.mark.parametrize("signed", [True, False])
+def test_counts_match_leading_terms(x0, o, signed):
+    leaves = Counter([graph_leaf_code(x, signed) for x in compute_leading_terms(x0, o)])
+    assert count_leading_terms(x0, o, signed) == leaf_counts(leaves)
+
+
+def test_counts_with_b_indices_match_leading_terms():
+    x0 = Graph(S(b(1), b(2)), Trace(G(), E(b(1)), G(), E(b(2))))
+    leaves = Counter([graph_leaf_code(x) for x in compute_leading_terms(x0, 2)])
+    assert count_leading_terms(x0, 2) == leaf_counts(leaves)
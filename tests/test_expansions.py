@@ -0,0 +1,61 @@
+import graph_expansion.expansions as expansions
+from graph_analysis import *
+from graph_expansion import *
+
+
+def slots(x: Graph):
+    # Every slot of x, with the traces in their stored rotations, which __eq__ ignores
+    parts = tuple(
+        tuple(
+            (
+                type(part),
+                (
+                    part.key
+                    if isinstance(part, Coefficient)
+                    else tuple(f.key for f in part)
+                ),
+            )
+            for part in getattr(x, name)
+        )
+        for name in [
+            "coefficients",
+            "traces",
+            "deterministics",
+            "light_weights",
+            "g_loops",
+        ]
+    )
+    return parts + (x.order, x.b_indices, x.max_b_index, x.p, x.n, hash(x))
+
+
+def test_children_match_graph(monkeypatch):
+    n_children = 0
+    child = expansions._child
+
+    def checked_child(prefix, new_coefficients, new_traces, f):
+        nonlocal n_children
+        x = child(prefix, new_coefficients, new_traces, f)
+        y = Graph(
+            list(prefix.coefficients),
+            list(prefix.traces),
+            f.coefficients,
+            new_coefficients,
+            new_traces,
+            f.traces,
+        )
+        assert slots(x) == slots(y)
+        n_children += 1
+        return x
+
+    monkeypatch.setattr(expansions, "_child", checked_child)
+    for x0, o in [
+        (Graph(Trace(G(), E(a(1)), adjoint(G()), E(a(2)), G(), E(a(3)))), 4),
+        (
+            Graph(
+                Trace(wtG(), E(a(1)), M(), E(a(2))), Trace(G(), E(a(3)), G(), E(a(4)))
+            ),
+            4,
+        ),
+    ]:
+        compute_leading_terms(x0, o, count_error_terms=True)
+    assert n_children > 0
@@ -0,0 +1,39 @@
+from fractions import Fraction
+
+from graph_analysis import *
+from graph_expansion import *
+
+x0 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+
+
+def equal_copy(x: Graph) -> Graph:
+    # == to x, with the symmetric coefficients stored transposed
+    return Graph(
+        [c.transpose() if c._symmetric else c for c in x.coefficients], x.traces
+    )
+
+
+def relabeled_copy(x: Graph) -> Graph:
+    return relabel(x, {i: b(i.i + 100) for i in x.b_indices})
+
+
+def test_like_terms_collapse():
+    terms = matrix_multiplication(compute_leading_terms(x0, 4))
+    for x in terms[:50]:
+        s = GraphSum([x, equal_copy(x), relabeled_copy(x)])
+        assert len(s) == 1
+        assert s[x] == 3
+
+
+def test_like_terms_cancel():
+    terms = compute_leading_terms(x0, 4)
+    copies = [equal_copy(relabeled_copy(x)) for x in terms]
+    assert (
+        len(matrix_multiplication_sum(terms) - matrix_multiplication_sum(copies)) == 0
+    )
+    assert (
+        len(GraphSum(terms) * Fraction(1, 2) - GraphSum(copies) * Fraction(1, 2)) == 0
+    )
+    assert GraphSum.merge([GraphSum(terms[:100]), GraphSum(terms[100:])]) == GraphSum(
+        copies
+    )
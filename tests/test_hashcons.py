@@ -0,0 +1,18 @@
+from graph_analysis import *
+from graph_expansion import *
+
+x0 = Graph(Trace(G(), E(a(1)), adjoint(G()), E(a(2)), G(), E(a(3))))
+
+
+def test_shared_leading_terms_hold_one_object_per_value():
+    leading_terms = list(iter_leading_terms(x0, 4))
+    table = HashConsTable()
+    shared = list(iter_leading_terms(x0, 4, table=table))
+    assert [to_python(x) for x in shared] == [to_python(x) for x in leading_terms]
+
+    report = memory_report(leading_terms)
+    shared_report = memory_report(shared)
+    assert shared_report.references == report.references
+    assert shared_report.values == report.values == len(table)
+    assert shared_report.objects == shared_report.values < report.objects
+    assert shared_report.bytes == shared_report.hash_consed_bytes < report.bytes
@@ -0,0 +1,121 @@
+import pytest
+
+from graph_analysis import *
+from graph_expansion import *
+
+x_3 = Graph(Trace(G(), E(a(1)), G(), E(a(2)), G(), E(a(3))))
+x_2_2 = Graph(Trace(G(), E(a(1)), G(), E(a(2))), Trace(G(), E(a(3)), G(), E(a(4))))
+
+
+def pairwise_contract_coefficients(
+    coefficients: list[Coefficient],
+) -> list[Coefficient]:
+    # The contraction matrix_multiplication used to do, which rescans the later
+    # coefficients for each coefficient
+    finished = False
+    while not finished:
+        finished = True
+        next_coefficients: list[Coefficient] = []
+        coefficients_to_remove: list[int] = []
+        for i, c in enumerate(coefficients):
+            if i in coefficients_to_remove:
+                continue
+            for j in range(i + 1, len(coefficients)):
+                c1 = coefficients[j]
+                if j in coefficients_to_remove or not set(c.indices) & set(c1.indices):
+                    continue
+                finished = False
+                product = single_matrix_multiplication(c, c1)
+                if not product:
+                    continue
+                next_coefficients.append(product)
+                coefficients_to_remove.extend([i, j])
+                break
+        next_coefficients += [
+            c for i, c in enumerate(coefficients) if i not in coefficients_to_remove
+        ]
+        coefficients = next_coefficients
+    return coefficients
+
+
+@pytest.mark.parametrize("x0", [x_3, x_2_2])
+def test_contraction_matches_pairwise(x0):
+    for x in compute_leading_terms(x0, 4):
+        expected = pairwise_contract_coefficients(list(x.coefficients))
+        assert contract_coefficients(list(x.coefficients)) == expected
+
+
+@pytest.mark.parametrize("x0", [x_3, x_2_2])
+def test_matrix_multiplication_matches_pairwise(monkeypatch, x0):
+    terms = compute_leading_terms(x0, 4)
+    out = [to_python(x) for x in matrix_multiplication(terms)]
+    monkeypatch.setattr(
+        "graph_analysis.simplification.contract_coefficients",
+        pairwise_contract_coefficients,
+    )
+    assert out == [to_python(x) for x in matrix_multiplication(terms)]
+
+
+def pairwise_vertical_cancel(x1: Graph, x2: Graph) -> Optional[Graph]:
+    # The notebook's test of whether two terms cancel vertically
+    differing_coefficients = [c for c in x1.coefficients if c not in x2.coefficients]
+    differing_coefficients += [c for c in x2.coefficients if c not in x1.coefficients]
+    differing_traces = [t for t in x1.traces if t not in x2.traces]
+    differing_traces += [t for t in x2.traces if t not in x1.traces]
+    if len(differing_coefficients) != 2 or differing_traces:
+        return None
+
+    product, identity = differing_coefficients
+    if not isinstance(product, ThetacalMS | SThetacalMS):
+        product, identity = identity, product
+    if (
+        not (isinstance(product, ThetacalMS) and isinstance(identity, I))
+        and not (isinstance(product, SThetacalMS) and isinstance(identity, S))
+    ) or set(product.indices) != set(identity.indices):
+        return None
+
+    cls = Theta if isinstance(product, ThetacalMS) else STheta
+    return Graph(
+        cls(product.charges[0], product.charges[1], product.i, product.j),
+        [c for c in x1.coefficients if c in x2.coefficients],
+        [t for t in x1.traces if t in x2.traces],
+    )
+
+
+def test_vertical_cancellations_match_pairwise():
+    # The leading terms don't cancel vertically, so each Theta and STheta of the first
+    # terms is replaced by the product and by the identity it cancels with
+    terms: list[Graph] = []
+    for x in matrix_multiplication(compute_leading_terms(x_2_2, 4))[:40]:
+        terms.append(x)
+        for k, c in enumerate(x.coefficients):
+            if isinstance(c, Theta | STheta):
+                product = ThetacalMS if isinstance(c, Theta) else SThetacalMS
+                identity = I(c.i, c.j) if isinstance(c, Theta) else S(c.i, c.j)
+                for replacement in [product(*c.charges, c.i, c.j), identity]:
+                    coefficients = list(x.coefficients)
+                    coefficients[k] = replacement
+                    terms.append(Graph(coefficients, x.traces))
+
+    # Every pair the notebook finds, with the term with the product first
+    expected = [
+        (i, j)
+        for i, x1 in enumerate(terms)
+        for j, x2 in enumerate(terms)
+        if i != j
+        and pairwise_vertical_cancel(x1, x2) is not None
+        and any(
+            isinstance(c, ThetacalMS | SThetacalMS)
+            for c in x1.coefficients
+            if c not in x2.coefficients
+        )
+    ]
+    pairs = find_vertical_cancellations(terms)
+    assert pairs
+    assert pairs == expected
+
+
+def test_products_without_a_class_are_not_taken():
+    coefficients: list[Coefficient] = [S(b(1), b(2)), S(b(2), b(3))]
+    assert single_matrix_multiplication(*coefficients) is None
+    assert contract_coefficients(coefficients) == coefficients